@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#                             BATCHRUN.PY:                                 #
+#             Runs xmlgen3.py over many CSV data files at once             #
+#                                                                          #
+############################################################################
+#                                                                          #
+# Example:                                                                 #
+#                                                                          #
+#     python3 batchrun.py --job defaults.toml submissions/                 #
+#                                                                          #
+# Each CSV (given directly, or found in a given directory) is processed as #
+# its own batch into output/<name of CSV>/. Settings come from the shared  #
+# job file, overridden by a job file next to the CSV with the same name    #
+# (e.g. batch1.toml or batch1.json for batch1.csv). When the shared job    #
+# file names a pidFile, its PIDs are divided among the batches in order.   #
+# The templates are loaded once, all prompts and PID requests happen up    #
+# front (each data file being checked as validate.py does before its PIDs  #
+# are requested), and the batches are then generated concurrently, each    #
+# logging to xmlgen.log in its own output directory. A combined summary of #
+# all the batches is written to output/summary.csv.                        #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import glob
+import os
+import sys
+
+import common
+import validate
+import xmlgen3
+
+
+# Reads the command-line options for the run.
+def parseArgs():
+    parser = argparse.ArgumentParser(
+        description='Generate FOXML files for many CSV data files at once.')
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+        help='CSV data file, or directory of CSV data files')
+    parser.add_argument('--job', metavar='FILE',
+        help='TOML or JSON job file with the settings shared by all batches')
+    parser.add_argument('--output-root', dest='outputRoot', default='output',
+        metavar='DIR', help='directory to hold the output of each batch (default: output)')
+    parser.add_argument('--concurrency', type=int, default=os.cpu_count(), metavar='N',
+        help='number of batches to generate at once (default: number of CPUs)')
+    return parser.parse_args()
+
+
+# Lists the data files (CSV or .xlsx) named on the command line, expanding
+# directories. Each batch is named after its data file without the extension,
+# so two data files with the same name (e.g. a.csv and a.xlsx, or a.csv in two
+# directories) would share an output directory, and the run is refused.
+def findDataFiles(paths):
+    dataFiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            dataFiles.extend(sorted(glob.glob(os.path.join(path, '*.csv')) + 
+                                    glob.glob(os.path.join(path, '*.xlsx'))))
+        else:
+            dataFiles.append(path)
+    byName = collections.defaultdict(list)
+    for dataFile in dataFiles:
+        byName[batchName(dataFile)].append(dataFile)
+    clashes = ['{0}: {1}'.format(name, ', '.join(files))
+               for name, files in byName.items() if len(files) > 1]
+    if clashes:
+        sys.exit('Error! These data files would share an output directory; rename them '
+                 'so that each has a different name:\n' + '\n'.join(clashes))
+    return dataFiles
+
+
+# The name of the batch for a data file, which is also the name of its output
+# directory.
+def batchName(dataFile):
+    return os.path.splitext(os.path.basename(dataFile))[0]
+
+
+# Merges the shared job settings with those in a job file next to the data file.
+def loadBatchJob(defaults, dataFile):
+    job = dict(defaults)
+    stem = os.path.splitext(dataFile)[0]
+    for extension in ('.toml', '.json'):
+        if os.path.isfile(stem + extension):
+            job.update(xmlgen3.readJobFile(stem + extension))
+            break
+    job['dataFile'] = dataFile
+    return xmlgen3.checkJob(job)
+
+
+# Generates one batch in a worker process, sending its screen output to a log
+# file in the batch's output directory. The Sharestream links, if given, are 
+# joined onto the rows as they are read.
+def generateBatch(batch, dataFile, dataFileArrangement, pidList, outputDir, linksFile=None):
+    with open(os.path.join(outputDir, 'xmlgen.log'), 'w') as log:
+        with contextlib.redirect_stdout(log):
+            dataRows = xmlgen3.readData(dataFile)
+            missingLinks = []
+            if linksFile:
+                dataRows = xmlgen3.joinSharestreamLinks(dataRows, linksFile, missingLinks)
+            result = xmlgen3.runBatch(batch, dataRows, dataFileArrangement, pidList, 
+                                      outputDir)
+            xmlgen3.reportJoin('FileNames have no Sharestream link', missingLinks)
+            return result
+
+
+def main():
+    args = parseArgs()
+    dataFiles = findDataFiles(args.paths)
+    defaults = xmlgen3.readJobFile(args.job) if args.job else {}
+    if defaults.get('quiet'):
+        common.verbosity = common.QUIET
+    elif defaults.get('verbose'):
+        common.verbosity = common.VERBOSE
+    xmlgen3.greeting(defaults.get('name'))
+
+    # Load and compile the templates once for all batches
+    templates = xmlgen3.loadTemplates()
+
+    # A PID file in the shared settings is divided among the batches in order
+    sharedPids = None
+    if 'pidFile' in defaults:
+        sharedPids = xmlgen3.parsePids(defaults['pidFile'])
+
+    # Prepare every batch up front, so that any prompts and PID requests are
+    # dealt with before generation starts
+    batches = []
+    for dataFile in dataFiles:
+        name = batchName(dataFile)
+        outputDir = os.path.join(args.outputRoot, name)
+        common.say('\n{0}\nBATCH {1}: {2}'.format('*' * 30, name, dataFile))
+        job = loadBatchJob(defaults, dataFile)
+        xmlgen3.setup_output_dirs(outputDir)
+        dataFileArrangement = xmlgen3.getArrangement(job.get('arrangement'))
+        job['mediaType'] = xmlgen3.getMediaType(job.get('mediaType'))[0].upper()
+        errors, rowCount = validate.reportErrors(dataFile, dataFileArrangement,
+                                                 job['mediaType'])
+        if errors:
+            sys.exit('Please correct {0} and try again. No PIDs have been reserved.'.format(
+                dataFile))
+        pidsNeeded = xmlgen3.analyzeDataFile(rowCount, dataFileArrangement)
+        if sharedPids is not None and job.get('pidFile') == defaults['pidFile']:
+            pidList, sharedPids = sharedPids[:pidsNeeded], sharedPids[pidsNeeded:]
+            common.say('Using {0} PIDs from the shared PID file.'.format(len(pidList)))
+        else:
+            pidList = xmlgen3.getPids(pidsNeeded, job, outputDir)
+        xmlgen3.checkPids(pidList, pidsNeeded)
+        pidList = pidList[:pidsNeeded]
+        batch = xmlgen3.setupBatch(job, templates)
+        batches.append((name, dataFile, outputDir,
+                        (batch, dataFile, dataFileArrangement, pidList, outputDir,
+                         job.get('sharestreamLinks'))))
+
+    # Generate the batches concurrently
+    common.say('\nGenerating {0} batches...'.format(len(batches)))
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {executor.submit(generateBatch, *batchArgs): name
+                   for name, dataFile, outputDir, batchArgs in batches}
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                common.say('Finished {0}: {1} files in {2} groups.'.format(
+                    name, results[name]['files'], results[name]['groups']))
+            except (Exception, SystemExit) as e:
+                results[name] = {'error': str(e) or e.__class__.__name__}
+                print('FAILED {0}: {1}'.format(name, results[name]['error']))
+
+    # Write the combined summary of all batches, in the order they were given
+    summaryPath = os.path.join(args.outputRoot, 'summary.csv')
+    with open(summaryPath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['batch', 'dataFile', 'outputDir', 'groups', 'files',
+                         'firstPID', 'lastPID', 'status'])
+        for name, dataFile, outputDir, batchArgs in batches:
+            result = results[name]
+            pidList = batchArgs[3]
+            writer.writerow([name, dataFile, outputDir,
+                             result.get('groups', ''), result.get('files', ''),
+                             pidList[0] if pidList else '',
+                             pidList[-1] if pidList else '',
+                             result.get('error', 'OK')])
+    common.say('\nSummary of all batches written to {0}'.format(summaryPath))
+    if any('error' in result for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
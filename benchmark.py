@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#                             BENCHMARK.PY:                                #
+#          Measures the throughput of the XML generator on made-up data    #
+#                                                                          #
+############################################################################
+#                                                                          #
+# Example:                                                                 #
+#                                                                          #
+#     python3 benchmark.py --rows 20000 --parts 3 --media-type V           #
+#                                                                          #
+# A synthetic multi-rowed CSV with every column in validate.py's           #
+# required_columns and video_columns is generated (or an existing one      #
+# given with --data-file is used), and run through the same pipeline as    #
+# xmlgen3.py in a single process, writing into a temporary directory: the  #
+# data file is checked and its rows counted as validate.py does, and the   #
+# batch is generated by runBatch through the same output sink (with its    #
+# writer threads) and checkpoint manifest as a run of xmlgen3.py. The time #
+# spent in each stage of the run (validate, render, write, manifest) is    #
+# reported as xmlgen3.py --stats does, along with the time in the main     #
+# rendering functions (reading the CSV, createUMAM, renderTechnicalMeta,   #
+# updateMets and createUMDM), the rows per second and peak memory use, as  #
+# JSON, so that runs on different versions can be compared. Function times #
+# are inclusive: the time in createUMAM includes renderTechnicalMeta. Run  #
+# it from the directory holding the templates, as with xmlgen3.py.         #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import contextlib
+import csv
+import functools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+try:
+    import resource     # not available on Windows
+except ImportError:
+    resource = None
+
+import validate
+import xmlgen3
+
+
+# The functions of xmlgen3.py whose time is measured
+functions = ['createUMAM', 'renderTechnicalMeta', 'updateMets', 'createUMDM']
+
+# Made-up values for the generated data
+dates = [('1965', 'exact', '20th century'),
+         ('1960-1969', 'range; circa', '20th century'),
+         ('1965-01-02;1966-03-04', 'multiple', '20th century'),
+         ('1899-1901', 'range', '19th century;20th century')]
+words = ['Baltimore', 'Campus', 'Football', 'Music', 'Radio', 'Students', 'Theater',
+         'Politics', 'Science', 'Agriculture', 'Chesapeake', 'Library', 'Jazz']
+
+
+# Generates a synthetic multi-rowed data file with the given number of rows: a
+# UMDM row followed by its UMAM parts for each object, with each UMDM having the
+# given number of subjects and agents. The last object takes an extra part if
+# only one row would be left for another, as a UMDM must have parts.
+def generateData(fileName, rows, parts=2, mediaType='V', subjects=3, agents=2, seed=0):
+    rng = random.Random(seed)
+    columns = validate.required_columns + validate.video_columns
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        written = 0
+        objectNumber = 0
+        while written < rows:
+            objectNumber += 1
+            identifier = 'bench-{0:06d}'.format(objectNumber)
+            date = dates[objectNumber % len(dates)]
+            row = dict.fromkeys(columns, '')
+            row.update({
+                'XMLType': 'UMDM', 'Identifier': identifier,
+                'Title': 'Recording {0} & friends'.format(objectNumber),
+                'Description/Summary': ' '.join(rng.choice(words) for i in range(30)),
+                'Creator': ';'.join('Person {0}'.format(rng.randint(1, 500))
+                                    for i in range(agents)),
+                'CreatorType': ';'.join('persName' for i in range(agents)),
+                'Contributor': 'University of Maryland', 'ContributorType': 'corpName',
+                'DateCreated': date[0], 'DateAttribute': date[1], 'Century': date[2],
+                'RepositoryBrowse': ';'.join(rng.sample(words, min(subjects, len(words)))),
+                'TopicalSubject': ';'.join(rng.choice(words) for i in range(subjects)),
+                'TopicalScheme': 'lcsh',
+                'PersonalSubject': ';'.join('Subject, {0}'.format(rng.randint(1, 500))
+                                            for i in range(subjects)),
+                'PersonalScheme': 'lcsh',
+                'GeographicalSubject': 'Maryland', 'GeographicalScheme': 'lcsh',
+                'MediaType': 'moving image' if mediaType == 'V' else 'sound',
+                'FormType': 'film' if mediaType == 'V' else 'audio', 'Form': 'film',
+                'ArchivalCollection': 'Benchmark Collection', 'Series': '1',
+                'Box': str(objectNumber // 20 + 1), 'Item': str(objectNumber),
+                'Department': 'SCPA', 'Dimensions': '16 mm"', 'Format': '16mm',
+                'Language': 'eng', 'Rights': 'Public', 'Continent': 'North America',
+                'Country': 'United States', 'Region/State': 'Maryland'
+                })
+            writer.writerow(row)
+            written += 1
+            objectParts = min(parts, rows - written)
+            if rows - written - objectParts == 1:
+                objectParts += 1
+            for partNumber in range(objectParts):
+                row = dict.fromkeys(columns, '')
+                row.update({
+                    'XMLType': 'UMAM', 'Identifier': identifier,
+                    'FileName': '{0}_{1}.{2}'.format(identifier, partNumber + 1,
+                                                     'm4v' if mediaType == 'V' else 'mp3'),
+                    'DurationDerivatives': '{0:02d}:{1:02d}:{2:02d}'.format(
+                        rng.randint(0, 2), rng.randint(0, 59), rng.randint(0, 59)),
+                    'DateDigitized': '2014-09-01', 'DigitizedByDept': 'DCR',
+                    'DigitizedByPers': 'Doe, J.',
+                    'SharestreamURLs': 'http://streaming.lib.umd.edu/?a={0}&b=1'.format(
+                        written),
+                    'Mono/Stereo': 'stereo', 'Language': 'eng', 'TrackFormat': 'stereo'
+                    })
+                if mediaType == 'V':
+                    row.update({
+                        'Color': 'color', 'DataRate': '1000 kbps', 'FrameRate': '30',
+                        'ScanSignal': 'progressive', 'VideoStandard': 'NTSC',
+                        'AspectRatio': '4:3', 'HorizontalPixels': '640',
+                        'VerticalPixels': '480'
+                        })
+                writer.writerow(row)
+                written += 1
+
+
+# Wraps a function so that its calls and the time spent in it are added to the
+# function statistics.
+def timed(name, function, stats):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats[name]['calls'] += 1
+            stats[name]['seconds'] += time.perf_counter() - start
+    return wrapper
+
+
+# Yields the rows of the data file, adding the time spent reading them to the
+# function statistics as readData.
+def timedRows(rows, stats):
+    rows = iter(rows)
+    while True:
+        start = time.perf_counter()
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        finally:
+            stats['readData']['calls'] += 1
+            stats['readData']['seconds'] += time.perf_counter() - start
+        yield row
+
+
+# Returns the peak memory use of the process so far, in kilobytes, or None where
+# it cannot be measured.
+def peakRss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+# Runs one batch through the pipeline in this process as runJob does, with the
+# rendering functions wrapped to measure them, and returns the results.
+def runBenchmark(dataFile, mediaType='V', timeFormat='I', writerThreads=1):
+    stats = {name: {'calls': 0, 'seconds': 0.0} for name in ['readData'] + functions}
+    metrics = xmlgen3.Metrics()
+    with metrics.stage('validate'):
+        errors, warnings, rowCount = validate.validateFile(dataFile, 'M', mediaType)
+    if errors:
+        sys.exit('{0} problems found in {1}; check it with validate.py.'.format(
+            len(errors), dataFile))
+    outputDir = tempfile.mkdtemp(prefix='xmlgen-bench-')
+    originals = {name: getattr(xmlgen3, name) for name in functions}
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            xmlgen3.setup_output_dirs(outputDir)
+            with metrics.stage('setup'):
+                batch = xmlgen3.setupBatch({'rights': 'P', 'mediaType': mediaType,
+                                            'collection': 'D', 'timeFormat': timeFormat})
+            for name in functions:
+                setattr(xmlgen3, name, timed(name, originals[name], stats))
+            pidList = ['bench:{0}'.format(n) for n in range(rowCount)]
+            run = {'dataFile': dataFile, 'arrangement': 'M',
+                   'answers': xmlgen3.batchAnswers(batch), 'pids': pidList}
+            start = time.perf_counter()
+            metrics.begin(rowCount)
+            manifest = xmlgen3.startManifest(run, outputDir=outputDir)
+            sink = xmlgen3.openSink(outputDir, writerThreads=writerThreads)
+            try:
+                result = xmlgen3.runBatch(batch, timedRows(xmlgen3.readData(dataFile), stats),
+                                          'M', pidList, outputDir, sink=sink,
+                                          manifest=manifest, metrics=metrics)
+            finally:
+                with metrics.stage('write'):
+                    sink.close()
+                manifest.close()
+            elapsed = time.perf_counter() - start
+    finally:
+        for name, function in originals.items():
+            setattr(xmlgen3, name, function)
+        shutil.rmtree(outputDir, ignore_errors=True)
+    runStats = metrics.stats()
+    return {
+            'python' :          platform.python_version(),
+            'dataFile' :        dataFile,
+            'rows' :            rowCount,
+            'groups' :          result['groups'],
+            'files' :           result['files'],
+            'bytes' :           sink.bytesWritten,
+            'writerThreads' :   writerThreads,
+            'seconds' :         round(elapsed, 4),
+            'rowsPerSecond' :   round(rowCount / elapsed, 1) if elapsed else None,
+            'peakRssKb' :       peakRss(),
+            'stages' :          runStats['stages'],
+            'functions' :       {name: {'calls': s['calls'], 'seconds': round(s['seconds'], 4)}
+                                 for name, s in stats.items()},
+            'caches' :          runStats['caches']
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the XML generator on synthetic data, reporting the results as JSON.')
+    parser.add_argument('--rows', type=int, default=10000,
+        help='number of CSV rows to generate (default: 10000)')
+    parser.add_argument('--parts', type=int, default=2,
+        help='number of UMAM parts for each UMDM (default: 2)')
+    parser.add_argument('--media-type', dest='mediaType', choices=('A', 'V'), default='V',
+        help='audio (A) or video (V) objects (default: V)')
+    parser.add_argument('--subjects', type=int, default=3,
+        help='number of topical and personal subjects for each UMDM (default: 3)')
+    parser.add_argument('--agents', type=int, default=2,
+        help='number of creators for each UMDM (default: 2)')
+    parser.add_argument('--time-format', dest='timeFormat', choices=('I', 'M'), default='I',
+        help='output runtimes in ISO (I) or minutes (M) (default: I)')
+    parser.add_argument('--seed', type=int, default=0,
+        help='random seed for the generated data (default: 0)')
+    parser.add_argument('--writer-threads', dest='writerThreads', type=int, default=1,
+        metavar='N', help='threads writing the output files, as in xmlgen3.py '
+                          '(default: 1; 0 writes them in the main thread)')
+    parser.add_argument('--data-file', dest='dataFile', metavar='FILE',
+        help='time an existing multi-rowed CSV instead of generating one')
+    parser.add_argument('--output', metavar='FILE',
+        help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.dataFile:
+        dataFile = args.dataFile
+        results = runBenchmark(dataFile, args.mediaType, args.timeFormat, args.writerThreads)
+    else:
+        handle, dataFile = tempfile.mkstemp(prefix='xmlgen-bench-', suffix='.csv')
+        os.close(handle)
+        try:
+            start = time.perf_counter()
+            generateData(dataFile, args.rows, args.parts, args.mediaType, args.subjects,
+                         args.agents, args.seed)
+            generated = time.perf_counter() - start
+            results = runBenchmark(dataFile, args.mediaType, args.timeFormat, args.writerThreads)
+        finally:
+            os.remove(dataFile)
+        results['dataFile'] = None
+        results['generated'] = {'rows': args.rows, 'parts': args.parts,
+                                'mediaType': args.mediaType, 'subjects': args.subjects,
+                                'agents': args.agents, 'seed': args.seed,
+                                'seconds': round(generated, 4)}
+    results['timeFormat'] = args.timeFormat
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
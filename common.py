@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#                               COMMON.PY:                                 #
+#       Helpers shared by xmlgen3.py and the tools that work alongside it  #
+#                                                                          #
+############################################################################
+#                                                                          #
+# The screen output settings, the Fedora HTTP session, the reading of data #
+# files (CSV or .xlsx), durations and dates, the joins onto the data rows, #
+# and the layout of the output directory and its manifest. validate.py,    #
+# handles.py and ingest.py import these from here rather than from         #
+# xmlgen3.py, which imports them in turn, so that there is only ever one   #
+# copy of each setting and cache however the program is started.           #
+#                                                                          #
+############################################################################
+
+
+import collections
+import contextlib
+import csv
+import datetime
+import functools
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+import requests
+import urllib3
+try:
+    import openpyxl     # for reading .xlsx data files
+except ImportError:
+    openpyxl = None
+
+
+# The size of each of the caches of XML fragments and dates, here and in 
+# xmlgen3.py. The same controlled vocabulary recurs throughout a collection, so
+# each distinct fragment is built once and reused for every later row, and for
+# any later batch in the process.
+fragmentCacheSize = 65536
+
+
+# How much the program reports on screen: QUIET shows only prompts and errors,
+# NORMAL adds the steps of the run and a progress line, and VERBOSE adds every
+# file written and the templates used.
+QUIET, NORMAL, VERBOSE = 0, 1, 2
+verbosity = NORMAL
+
+
+# Prints a message if the program is reporting at the given level or above.
+def say(message='', level=NORMAL, end='\n'):
+    if verbosity >= level:
+        print(message, end=end)
+
+
+# Returns the answer supplied for a prompt by the job settings, echoing it to the
+# screen in place of the user's typing, or asks the user if no answer was supplied.
+def ask(prompt, answer=None, echo=True):
+    if answer is None:
+        return input(prompt)
+    say(prompt + (str(answer) if echo else '********'))
+    return answer
+
+
+# The server errors after which a request is tried again
+retryStatuses = (500, 502, 503, 504)
+
+
+# Opens an HTTP session to a Fedora server, reusing pooled keep-alive connections
+# and retrying failed requests with exponential backoff. Only requests using the
+# allowed methods are retried once sent (by default the idempotent ones, so not
+# POST), as the server may have acted on a request whose response was lost; any
+# request is retried if the connection could not be made.
+def fedoraSession(username=None, password=None, poolSize=1, retries=5,
+                  allowedMethods=urllib3.util.Retry.DEFAULT_ALLOWED_METHODS):
+    session = requests.Session()
+    if username is not None:
+        session.auth = (username, password)
+    retry = urllib3.util.Retry(total=retries, backoff_factor=0.5,
+                               status_forcelist=retryStatuses if retries else (),
+                               allowed_methods=allowedMethods)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize, 
+                                            pool_maxsize=poolSize, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Sends a request that the server acts on, such as an ingest or a request for 
+# new PIDs, through a session opened with no retries of its own, trying it 
+# again with backoff after a server error or lost connection, unless the error
+# is one that final (if given) picks out as not worth retrying. Returns the last
+# response and the number of the attempt that gave it (1 for the first), so 
+# that the caller can allow for the server having acted on an earlier attempt.
+def sendRequest(session, method, url, retries=5, backoff=0.5, final=None, **kwargs):
+    for attempt in range(1, retries + 2):
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt > retries:
+                raise
+        else:
+            if (response.status_code not in retryStatuses or attempt > retries or
+                    (final is not None and final(response))):
+                return response, attempt
+        time.sleep(backoff * 2 ** (attempt - 1))
+
+
+# Matches a runtime in the format 'HH:MM:SS', optionally with a fraction of a 
+# second ('HH:MM:SS.fff').
+durationPattern = re.compile(r'\s*(\d+):(\d+):(\d+)(?:\.(\d+))?\s*$')
+
+
+# Parses a runtime string into a whole number of milliseconds, raising ValueError
+# if it cannot be read. Each distinct string is parsed only once, however many 
+# rows repeat it.
+@functools.lru_cache(maxsize=16384)
+def parseDuration(inputTime):
+    match = durationPattern.match(inputTime)
+    if match is None:
+        raise ValueError('Bad duration: {0!r}'.format(inputTime))
+    hh, mm, ss, fraction = match.groups()
+    milliseconds = int((fraction or '0').ljust(3, '0')[:3])
+    return ((int(hh) * 60 + int(mm)) * 60 + int(ss)) * 1000 + milliseconds
+
+
+# Formats milliseconds as 'HH:MM:SS', adding the milliseconds ('HH:MM:SS.fff') 
+# only if there are any. Hours are not wrapped at 24.
+def formatDuration(milliseconds):
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    result = '{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+    if milliseconds:
+        result += '.{0:03d}'.format(milliseconds)
+    return result
+
+
+# The forms of date accepted: a year (YYYY), a year and month (YYYY-MM) or a full 
+# date (YYYY-MM-DD), and a range between any two of those.
+dateForm = r'(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?'
+datePattern = re.compile(r'\s*{0}\s*$'.format(dateForm))
+dateRangePattern = re.compile(r'\s*({0})\s*-\s*({0})\s*$'.format(
+    r'\d{4}(?:-\d{2}(?:-\d{2})?)?'))
+
+
+# Checks that a date in one of the accepted forms is a real date, raising 
+# ValueError if not.
+def checkDate(value):
+    year, month, day = datePattern.match(value).groups()
+    datetime.date(int(year), int(month or 1), int(day or 1))
+
+
+# Normalizes the DateCreated and DateAttribute columns of the input data into
+# the certainty ('circa' or 'exact') and the list of dates, each with its value
+# and, for ranges, its begin and end dates. The attribute may contain 'multiple'
+# (dates separated by ';'), 'range' and 'circa'. Raises ValueError for any date
+# not in one of the accepted forms. Each distinct pair is normalized only once;
+# the result is shared, so is not to be modified.
+@functools.lru_cache(maxsize=fragmentCacheSize)
+def normalizeDate(inputDate, inputAttribute):
+    if 'multiple' in inputAttribute:            # multiple or single date?
+        values = inputDate.split(';')
+    else:
+        values = [inputDate]
+    dates = []
+    for value in values:
+        value = value.strip()
+        if 'range' in inputAttribute:           # range or point?
+            match = dateRangePattern.match(value)
+            if match is None:
+                raise ValueError('Unreadable date range "{0}" (expected two dates '
+                                 'such as 1960-1969 or 1901-01-01-1902-02-02)'.format(value))
+            begin, end = match.groups()
+            if begin[:4] > end[:4]:
+                raise ValueError('Date range "{0}" ends before it begins'.format(value))
+        else:
+            if value and datePattern.match(value) is None:
+                raise ValueError('Unreadable date "{0}" (expected YYYY, YYYY-MM or '
+                                 'YYYY-MM-DD, or a DateAttribute of range)'.format(value))
+            begin = end = None
+        for endpoint in (begin, end) if begin is not None else (value,) if value else ():
+            try:
+                checkDate(endpoint)
+            except ValueError:
+                raise ValueError('No such date: "{0}"'.format(endpoint))
+        dates.append({'value': value, 'begin': begin, 'end': end})
+    return {
+            'certainty' :   'circa' if 'circa' in inputAttribute else 'exact',
+            'dates' :       tuple(dates)
+            }
+
+
+# Returns the text of a spreadsheet cell as it would appear in a CSV export: 
+# whole numbers without a decimal point, dates as YYYY-MM-DD, and times of day
+# or durations as HH:MM:SS.
+def cellText(value):
+    if value is None:
+        return ''
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    elif isinstance(value, datetime.datetime):
+        if value.time() == datetime.time():
+            return value.date().isoformat()
+        return value.isoformat(sep=' ')
+    elif isinstance(value, datetime.date):
+        return value.isoformat()
+    elif isinstance(value, datetime.time):
+        return formatDuration(((value.hour * 60 + value.minute) * 60 + value.second) * 1000
+                              + value.microsecond // 1000)
+    elif isinstance(value, datetime.timedelta):
+        return formatDuration(round(value.total_seconds() * 1000))
+    return str(value)
+
+
+# Reads the first worksheet of an Excel workbook in the same way as csv.DictReader,
+# one row at a time, with the header row giving the fieldnames. Every value is
+# read as text, and rows with nothing in them are skipped.
+class SheetReader:
+
+    def __init__(self, worksheet):
+        self.rows = worksheet.iter_rows(values_only=True)
+        self.fieldnames = [cellText(value) for value in next(self.rows, ())]
+        while self.fieldnames and not self.fieldnames[-1]:
+            self.fieldnames.pop()
+
+    def __iter__(self):
+        for values in self.rows:
+            values = [cellText(value) for value in values[:len(self.fieldnames)]]
+            if any(values):
+                yield dict(itertools.zip_longest(self.fieldnames, values, fillvalue=''))
+
+
+# Opens a data file for reading one row at a time as a dictionary: a CSV file, 
+# or an Excel workbook (.xlsx), which is read in read-only mode so that only 
+# the row being read is held in memory. Yields the reader, which has the column
+# names as its fieldnames.
+@contextlib.contextmanager
+def openData(fileName):
+    if isWorkbook(fileName):
+        if openpyxl is None:
+            sys.exit('Reading .xlsx data files requires openpyxl (pip install openpyxl).')
+        workbook = openpyxl.load_workbook(fileName, read_only=True, data_only=True)
+        try:
+            yield SheetReader(workbook.worksheets[0])
+        finally:
+            workbook.close()
+    else:
+        with open(fileName, 'r', newline='') as f:
+            yield csv.DictReader(f)
+
+
+# Whether a data file is an Excel workbook rather than a CSV file.
+def isWorkbook(fileName):
+    return fileName.lower().endswith('.xlsx')
+
+
+# Loads a CSV file into a lookup table for joining onto the data rows, keyed on
+# the first of keyColumns found in the header, with a dictionary of the values
+# of valueColumns for each key. Any lines before the header row (such as the 
+# title line of a Sharestream export) are skipped. Returns the table and the 
+# keys found more than once, with their counts; the first row for a key is used.
+def loadJoinTable(fileName, keyColumns, valueColumns):
+    table = {}
+    counts = collections.Counter()
+    with open(fileName, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        for header in reader:
+            keyColumn = next((c for c in keyColumns if c in header), None)
+            if keyColumn is not None:
+                break
+        else:
+            sys.exit('No {0} column found in {1}'.format(' or '.join(keyColumns), fileName))
+        for c in valueColumns:
+            if c not in header:
+                sys.exit('No {0} column found in {1}'.format(c, fileName))
+        keyIndex = header.index(keyColumn)
+        valueIndexes = [(c, header.index(c)) for c in valueColumns]
+        for row in reader:
+            key = row[keyIndex].strip() if keyIndex < len(row) else ''
+            if not key:
+                continue
+            counts[key] += 1
+            if key not in table:
+                table[key] = {c: row[i] if i < len(row) else '' for c, i in valueIndexes}
+    return table, {key: n for key, n in counts.items() if n > 1}
+
+
+# Joins a lookup table onto the data rows as they stream past, filling in the
+# table's columns on each row whose keyColumn matches a key. Rows with nothing
+# in keyColumn are passed through untouched, and the keys of rows with no match
+# are added to missing, if given.
+def joinRows(rows, table, keyColumn, missing=None):
+    for row in rows:
+        key = (row.get(keyColumn) or '').strip()
+        if key:
+            values = table.get(key)
+            if values is not None:
+                row.update(values)
+            elif missing is not None:
+                missing.append(key)
+        yield row
+
+
+# Prints a warning about the keys that could not be joined, or were found more
+# than once in a lookup table, naming the first few.
+def reportJoin(problem, keys):
+    if keys:
+        print('Warning: {0} {1}: {2}{3}'.format(len(keys), problem, 
+              ', '.join(itertools.islice(keys, 10)), ', ...' if len(keys) > 10 else ''))
+
+
+# Returns the path of an output file relative to the output directory, with XML
+# files in the sub-dir 'foxml'.
+def outputPath(fileStem, extension):
+    if extension == '.xml':
+        return os.path.join('foxml', fileStem + extension)
+    else:
+        return fileStem + extension
+
+
+# Filters out blank lines and lines containing only spaces from XML
+def cleanContent(content):
+    return os.linesep.join(
+        [line for line in content.splitlines() if line.strip()])
+
+
+# The checkpoint manifest kept in the output directory as a batch is generated.
+# Its first line records the settings and PIDs of the run, and each later line 
+# one completed object group: its PIDs, the SHA-256 hash of each file written,
+# and the digest of each object for comparison by a later run.
+manifestFile = 'manifest.jsonl'
+
+
+# Reads a manifest file, returning the run's settings and the records of its
+# groups in order, up to any partial line left by an interruption.
+def readManifest(manifestPath):
+    with open(manifestPath, 'r') as f:
+        lines = f.read().splitlines()
+    records = []
+    for line in lines[1:]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+    return json.loads(lines[0]), records
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#                              HANDLES.PY:                                 #
+#           Looks up the handles assigned to UMDM objects by Fedora        #
+#                                                                          #
+############################################################################
+#                                                                          #
+# Usage:                                                                   #
+#                                                                          #
+#     python3 handles.py join output/links.txt batch1.csv                  #
+#     python3 handles.py list < pids.txt                                   #
+#     python3 handles.py invalidate [PID ...]                              #
+#                                                                          #
+# join looks up the handle for each UMDM PID listed in links.txt, several  #
+# at a time, and writes handled.csv: the rows of the metadata CSV joined   #
+# on their Identifier with the pid and handle of the UMDM object. The same #
+# lookup can be run straight after generation with xmlgen3.py --handles.   #
+# list looks up the PIDs read from standard input and appends "pid,handle" #
+# lines to result.csv. Handles found are kept in a local SQLite cache      #
+# (handles.db), so repeated lookups of a PID within the cache's time to    #
+# live are answered without going to the server; invalidate removes the    #
+# given PIDs from the cache, or all of them if none are given.             #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import concurrent.futures
+import csv
+import re
+import sqlite3
+import sys
+import time
+
+import common
+
+
+# The handle lookup endpoint, taking the PID as a query parameter
+handleServer = 'http://fedora.lib.umd.edu/handle/'
+
+# Matches the handle URL in the lookup server's response
+handlePattern = re.compile(r'<handlehttp>\s*(.*?)\s*</handlehttp>')
+
+
+# The local cache of handles already fetched, and how long its entries are used
+handleCacheFile = 'handles.db'
+handleCacheTtl = 30 * 24 * 60 * 60      # seconds
+
+
+# Opens the handle cache, creating it if necessary.
+def openHandleCache(fileName=handleCacheFile):
+    cache = sqlite3.connect(fileName)
+    cache.execute('CREATE TABLE IF NOT EXISTS handles ('
+                  'pid TEXT PRIMARY KEY, handle TEXT NOT NULL, fetched REAL NOT NULL)')
+    cache.commit()
+    return cache
+
+
+# Returns the handles cached for any of the given PIDs that were fetched within
+# the time to live, as a dictionary keyed by PID.
+def cachedHandles(cache, pids, ttl=handleCacheTtl):
+    oldest = time.time() - ttl
+    handles = {}
+    for pid in pids:
+        row = cache.execute('SELECT handle FROM handles WHERE pid = ? AND fetched >= ?',
+                            (pid, oldest)).fetchone()
+        if row:
+            handles[pid] = row[0]
+    return handles
+
+
+# Stores newly fetched handles in the cache. Empty results (objects not yet given
+# a handle) are not stored, so that they are looked up again next time.
+def storeHandles(cache, handles):
+    now = time.time()
+    cache.executemany('INSERT OR REPLACE INTO handles (pid, handle, fetched) VALUES (?, ?, ?)',
+                      [(pid, handle, now) for pid, handle in handles.items() if handle])
+    cache.commit()
+
+
+# Removes the given PIDs from the cache, or every entry if no PIDs are given.
+def invalidateHandles(cache, pids=None):
+    if pids:
+        cache.executemany('DELETE FROM handles WHERE pid = ?', [(pid,) for pid in pids])
+    else:
+        cache.execute('DELETE FROM handles')
+    cache.commit()
+
+
+# Looks up the handle for a single PID, returning an empty string if the server
+# has none for it.
+def lookupHandle(session, pid, url=handleServer):
+    response = session.get(url, params={'action': 'lookup', 'pid': pid}, timeout=60)
+    response.raise_for_status()
+    match = handlePattern.search(response.text)
+    return match.group(1) if match else ''
+
+
+# Looks up the handles for a list of PIDs, answering from the cache where it can
+# and otherwise with at most the given number of requests running at once over 
+# pooled keep-alive connections. Returns a dictionary of handles keyed by PID, 
+# with '' for PIDs that have no handle yet, which are listed in a warning; PIDs
+# whose lookup failed even after retrying are reported and left out.
+def lookupHandles(pids, workers=8, url=handleServer, cache=None, ttl=handleCacheTtl):
+    handles = cachedHandles(cache, pids, ttl) if cache is not None else {}
+    toFetch = [pid for pid in pids if pid not in handles]
+    fetched = {}
+    if toFetch:
+        session = common.fedoraSession(poolSize=workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(lookupHandle, session, pid, url): pid
+                       for pid in toFetch}
+            for future in concurrent.futures.as_completed(futures):
+                pid = futures[future]
+                try:
+                    fetched[pid] = future.result()
+                except Exception as e:
+                    print('Error! Handle lookup failed for {0}: {1}'.format(pid, e))
+        session.close()
+        if cache is not None:
+            storeHandles(cache, fetched)
+    handles.update(fetched)
+    common.say('Found {0} of {1} handles ({2} from the cache, {3} fetched).'.format(
+        sum(1 for handle in handles.values() if handle), len(pids), 
+        len(pids) - len(toFetch), sum(1 for handle in fetched.values() if handle)))
+    common.reportJoin('PIDs have no handle yet', 
+                      [pid for pid in pids if handles.get(pid) == ''])
+    return handles
+
+
+# Reads the (PID, Identifier) pairs of the UMDM objects listed in a links file.
+def readUMDMLinks(linksFile):
+    with open(linksFile, 'r', newline='') as f:
+        return [(row[2], row[0]) for row in csv.reader(f)
+                if len(row) > 2 and row[1] == 'UMDM']
+
+
+# Writes a copy of the metadata CSV with the pid and handle of the UMDM object
+# added to every row with a matching Identifier, joining them on as the rows are
+# read in the same way as the Sharestream links. Rows with no match are kept,
+# with the new columns left empty.
+def writeHandled(dataFile, umdmList, handles, outFile='handled.csv'):
+    byIdentifier = {identifier: {'pid': pid, 'handle': handles.get(pid, '')}
+                    for pid, identifier in umdmList}
+    missing = []
+    with common.openData(dataFile) as reader, open(outFile, 'w', newline='') as out:
+        writer = csv.DictWriter(out, reader.fieldnames + ['pid', 'handle'], restval='')
+        writer.writeheader()
+        writer.writerows(common.joinRows(reader, byIdentifier, 'Identifier', missing))
+    common.reportJoin('Identifiers have no UMDM object', list(dict.fromkeys(missing)))
+    common.say('Wrote {0}'.format(outFile))
+
+
+# Looks up the handles for the UMDM objects of a batch and writes handled.csv.
+# The cache file may be None to always go to the server.
+def joinHandles(dataFile, umdmList, outFile='handled.csv', workers=8, url=handleServer,
+                cacheFile=handleCacheFile):
+    common.say('\nFetching handles for {0} UMDM objects...'.format(len(umdmList)))
+    cache = openHandleCache(cacheFile) if cacheFile else None
+    handles = lookupHandles([pid for pid, identifier in umdmList], workers, url, cache)
+    if cache is not None:
+        cache.close()
+    writeHandled(dataFile, umdmList, handles, outFile)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Look up handles for Fedora PIDs, keeping them in a local cache.')
+    parser.add_argument('--workers', type=int, default=8, metavar='N',
+        help='number of lookups to run at once (default: 8)')
+    parser.add_argument('--handle-url', dest='handleUrl', default=handleServer,
+        metavar='URL', help='handle lookup endpoint (e.g. a test server)')
+    parser.add_argument('--cache', default=handleCacheFile, metavar='FILE',
+        help='handle cache file (default: handles.db)')
+    parser.add_argument('--no-cache', dest='cache', action='store_const', const=None,
+        help='always look handles up on the server')
+    parser.add_argument('--cache-ttl', dest='cacheTtl', type=float, default=30, 
+        metavar='DAYS', help='days for which cached handles are used (default: 30)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    join = commands.add_parser('join', 
+        help='join the handles of the UMDM objects in links.txt to the metadata CSV')
+    join.add_argument('linksFile', help='links.txt written by xmlgen3.py')
+    join.add_argument('dataFile', help='metadata CSV for the batch')
+    join.add_argument('-o', '--output', default='handled.csv',
+        help='joined CSV to write (default: handled.csv)')
+    commands.add_parser('list', 
+        help='look up the PIDs read from standard input, appending them to result.csv')
+    invalidate = commands.add_parser('invalidate', 
+        help='remove PIDs from the cache (all of them if none are given)')
+    invalidate.add_argument('pids', nargs='*', metavar='PID')
+    args = parser.parse_args()
+
+    cache = openHandleCache(args.cache) if args.cache else None
+    if args.command == 'join':
+        umdmList = readUMDMLinks(args.linksFile)
+        common.say('\nFetching handles for {0} UMDM objects...'.format(len(umdmList)))
+        handles = lookupHandles([pid for pid, identifier in umdmList], args.workers,
+                                args.handleUrl, cache, args.cacheTtl * 24 * 60 * 60)
+        writeHandled(args.dataFile, umdmList, handles, args.output)
+    elif args.command == 'list':
+        pids = [line.strip() for line in sys.stdin if line.strip()]
+        handles = lookupHandles(pids, args.workers, args.handleUrl, cache,
+                                args.cacheTtl * 24 * 60 * 60)
+        with open('result.csv', 'a') as f:
+            for pid in pids:
+                f.write('{0}, {1}\n'.format(pid, handles.get(pid, '')))
+    elif args.command == 'invalidate':
+        if cache is None:
+            sys.exit('No cache to invalidate.')
+        invalidateHandles(cache, args.pids)
+        common.say('Removed {0} from the handle cache.'.format(
+            ', '.join(args.pids) if args.pids else 'all entries'))
+    if cache is not None:
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
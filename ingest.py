@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#                               INGEST.PY:                                 #
+#            Ingests the generated FOXML files into a Fedora server        #
+#                                                                          #
+############################################################################
+#                                                                          #
+# Usage:                                                                   #
+#                                                                          #
+#     python3 ingest.py output --server S --workers 8                      #
+#     python3 ingest.py output --url http://localhost:8080/fedora/objects/ #
+#                                                                          #
+# Each object group listed in the output directory's manifest is posted to #
+# the Fedora ingest endpoint of the stage (S) or production (P) server, or #
+# of any given URL (e.g. a test server), with several groups in flight at  #
+# once over pooled keep-alive connections. Within a group the UMAM parts   #
+# are ingested before their UMDM, which is held back if any part fails.    #
+# Failed requests are retried with backoff (an object found to exist on a  #
+# retry counts as ingested), and the outcome for each PID is appended to a #
+# ledger (ingest.jsonl in the output directory), so that a re-run ingests  #
+# only the objects not already ingested. xmlgen3.py can ingest each group  #
+# as soon as it is generated when given --ingest.                          #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+import requests
+
+import verify
+import common
+
+
+# The REST endpoints of the stage and production servers for ingesting objects,
+# taking the PID as the last part of the path
+ingestServers = {
+    'S' : 'http://fedorastage.lib.umd.edu/fedora/objects/',
+    'P' : 'http://fedora.lib.umd.edu/fedora/objects/'
+    }
+
+# The format of the documents posted
+foxmlFormat = 'info:fedora/fedora-system:FOXML-1.1'
+
+# The ledger of ingested and failed objects, kept in the output directory
+ledgerFile = 'ingest.jsonl'
+
+
+# Reads the ledger left by earlier runs, returning the latest outcome for each
+# PID ('ingested' or 'failed').
+def readLedger(ledgerPath):
+    outcomes = {}
+    if not os.path.isfile(ledgerPath):
+        return outcomes
+    with open(ledgerPath, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break                       # a partial line left by an interruption
+            outcomes[entry['pid']] = entry['status']
+    return outcomes
+
+
+# Whether a response says that the object already exists: Fedora answers an 
+# ingest of an existing PID with an ObjectExistsException (500, or 409).
+def objectExists(response):
+    return response.status_code == 409 or (
+        response.status_code == 500 and 'ObjectExistsException' in response.text)
+
+
+# Posts one FOXML document to the ingest endpoint, raising an exception if the
+# server does not accept it after retrying. If a retry finds that the object 
+# already exists, an earlier attempt was ingested although its response was 
+# lost, and the object counts as ingested; if the first attempt does, the PID
+# was already in use and the ingest fails.
+def ingestObject(session, url, pid, data):
+    response, attempt = common.sendRequest(
+        session, 'POST', url.rstrip('/') + '/' + urllib.parse.quote(pid, safe=':'),
+        params={'format': foxmlFormat, 'logMessage': 'Ingested by xmlgen3.py'},
+        data=data, headers={'Content-Type': 'text/xml; charset=utf-8'}, timeout=120,
+        final=objectExists)
+    if attempt > 1 and objectExists(response):
+        return
+    response.raise_for_status()
+
+
+# Ingests the documents of one object group in order, as a task in the pool. The
+# UMDM (umdmPid) is not posted if any of its parts failed, so that Fedora never
+# holds a UMDM whose parts are missing. The documents are given as the bytes of
+# their FOXML files, as written. Each document is first checked as verify.py 
+# does, if requested. Returns the outcome for each PID as (pid, status, message).
+def ingestGroup(session, url, documents, umdmPid, check=False, schemaDir=None):
+    results = []
+    partFailed = False
+    for pid, data in documents:
+        if pid == umdmPid and partFailed:
+            results.append((pid, 'failed', 'not ingested as some of its parts failed'))
+            continue
+        failures = verify.verifyDocument(pid, data, schemaDir) if check else []
+        if failures:
+            results.append((pid, 'failed', 'failed verification: line {0}: {1}'.format(
+                failures[0]['line'], failures[0]['message'])))
+        else:
+            try:
+                ingestObject(session, url, pid, data)
+                results.append((pid, 'ingested', ''))
+            except requests.RequestException as e:
+                results.append((pid, 'failed', str(e)))
+        if results[-1][1] == 'failed':
+            partFailed = True
+    return results
+
+
+# Ingests object groups as they are handed to it, with at most the given number
+# of groups being posted at once and a bounded number waiting, so that it can
+# take groups straight from the generator. The outcome for each PID is appended
+# to the ledger in the output directory, and PIDs already ingested according to
+# the ledger are left out. Counts are kept in the metrics, if given.
+class Ingester:
+
+    def __init__(self, url, username=None, password=None, workers=4, outputDir='output',
+                 check=False, schemaDir=None, metrics=None):
+        self.url = url
+        self.check = check
+        self.schemaDir = schemaDir
+        self.metrics = metrics
+        self.session = common.fedoraSession(username, password, poolSize=workers, retries=0)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.window = workers * 4
+        self.pending = collections.deque()
+        self.ledgerPath = os.path.join(outputDir, ledgerFile)
+        self.outcomes = readLedger(self.ledgerPath)
+        self.ledger = open(self.ledgerPath, 'a')
+        self.counts = collections.Counter()
+
+    # Queues a group for ingest, given as (pid, data) pairs with the UMDM last,
+    # waiting for the oldest group to finish if too many are in flight. The PID
+    # of the group's UMDM is given, as the documents may be only the parts when
+    # only changed objects were written.
+    def submit(self, documents, umdmPid):
+        toIngest = [(pid, data) for pid, data in documents
+                    if self.outcomes.get(pid) != 'ingested']
+        self.counts['already'] += len(documents) - len(toIngest)
+        if not toIngest:
+            return
+        self.pending.append(self.executor.submit(ingestGroup, self.session, self.url,
+                                                 toIngest, umdmPid, self.check,
+                                                 self.schemaDir))
+        while len(self.pending) >= self.window:
+            self.record(self.pending.popleft().result())
+
+    # Appends the outcomes of a finished group to the ledger.
+    def record(self, results):
+        for pid, status, message in results:
+            self.ledger.write(json.dumps({'pid': pid, 'status': status, 'message': message,
+                                          'time': time.strftime('%Y-%m-%dT%H:%M:%S')}) + '\n')
+            self.outcomes[pid] = status
+            self.counts[status] += 1
+            if self.metrics is not None:
+                self.metrics.count('ingested' if status == 'ingested' else 'ingestFailed')
+            if status == 'failed':
+                print('Error! Ingest failed for {0}: {1}'.format(pid, message))
+        self.ledger.flush()
+
+    # Waits for the groups still in flight, and closes the session and ledger.
+    # Returns the counts of objects ingested, failed and already ingested.
+    def close(self):
+        while self.pending:
+            self.record(self.pending.popleft().result())
+        self.executor.shutdown()
+        self.session.close()
+        self.ledger.close()
+        common.say('\n{0} objects ingested, {1} failed, {2} already ingested. '
+               'Outcomes written to {3}'.format(self.counts['ingested'],
+               self.counts['failed'], self.counts['already'], self.ledgerPath))
+        return self.counts
+
+
+# Reads the object groups of a finished run from its manifest and FOXML files,
+# yielding the PID of each group's UMDM (the last of its PIDs) and its objects
+# as (pid, data) pairs with the UMDM last. Only the objects whose files were 
+# written are included (all of them unless the run wrote only changed objects).
+def readGroups(outputDir='output'):
+    manifestPath = os.path.join(outputDir, common.manifestFile)
+    if not os.path.isfile(manifestPath):
+        sys.exit('No manifest listing the objects to ingest: {0}'.format(manifestPath))
+    run, records = common.readManifest(manifestPath)
+    for record in records:
+        documents = []
+        for pid in record['pids']:
+            path = common.outputPath(pid.replace(':', '_').strip(), '.xml')
+            if path in record['files']:
+                with open(os.path.join(outputDir, path), 'rb') as f:
+                    documents.append((pid, f.read()))
+        if documents:
+            yield documents, record['pids'][-1]
+
+
+# Asks for the endpoint and credentials for ingest, unless given in the job.
+def ingestSettings(job):
+    url = job.get('ingestUrl')
+    if url is None:
+        serverChoice = common.ask('Enter S to ingest into fedoraStage, P to ingest into '
+                                  'Production: ', job.get('ingest'))
+        while (serverChoice not in ('S', 'P')):
+            serverChoice = input('Error: You must enter S or P: ')
+        url = ingestServers[serverChoice]
+    username = common.ask('\nEnter the server username: ', job.get('username'))
+    password = common.ask('Enter the server password: ', job.get('password'), echo=False)
+    return url, username, password
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Ingest the FOXML files written by xmlgen3.py into Fedora.')
+    parser.add_argument('outputDir', help='output directory written by xmlgen3.py')
+    parser.add_argument('--server', dest='ingest', choices=('S', 'P'),
+        help='ingest into fedoraStage (S) or Production (P)')
+    parser.add_argument('--url', dest='ingestUrl', metavar='URL',
+        help='ingest endpoint to use instead (e.g. a test server)')
+    parser.add_argument('--username', help='server username')
+    parser.add_argument('--password', help='server password')
+    parser.add_argument('--workers', type=int, default=4, metavar='N',
+        help='number of object groups to ingest at once (default: 4)')
+    parser.add_argument('--verify', action='store_true',
+        help='check that each document is well-formed before posting it')
+    parser.add_argument('--schemas', metavar='DIR',
+        help='with --verify, also validate datastreams against the schemas in DIR')
+    args = parser.parse_args()
+
+    url, username, password = ingestSettings(vars(args))
+    common.say('\nIngesting the objects in {0} into {1}...'.format(args.outputDir, url))
+    ingester = Ingester(url, username, password, args.workers, args.outputDir,
+                        args.verify, args.schemas)
+    for documents, umdmPid in readGroups(args.outputDir):
+        ingester.submit(documents, umdmPid)
+    if ingester.close()['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,10 @@
 #!/usr/bin/env bash
 
+# Looks up the handles of the UMDM objects listed in a links file and joins them
+# to the metadata CSV as handled.csv. This is now done by handles.py, which runs
+# the lookups concurrently; see python3 handles.py --help for its options.
+
 INFILE=$1
 OUTFILE=$2
 
-touch result.csv
-echo "filename,pid,handle" >> result.csv
-
-while read filename pid
-do
-    echo "Fetching handle for $pid ..."
-    handle=$(curl -sS "http://fedora.lib.umd.edu/handle/?action=lookup&pid=$pid" | \
-    awk '/<handlehttp>/ {b=13; e=(length($0)-25); print substr($0,b,e)}')
-    echo "$filename, $pid, $handle" >> result.csv
-done < <(awk -F "," '$2=="\"UMDM\"" {gsub(/"/,""); print $1,$3}' $INFILE)
-
-csvjoin -c 'Identifier,filename' --left $OUTFILE result.csv > handled.csv
+python3 "$(dirname "$0")/../handles.py" join "$INFILE" "$OUTFILE" -o handled.csv
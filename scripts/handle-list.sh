@@ -1,9 +1,7 @@
 #!/usr/bin/env bash
 
-while read pid
-do
-    echo "Fetching handle for $pid ..."
-    handle=$(curl -sS "http://fedora.lib.umd.edu/handle/?action=lookup&pid=$pid" | \
-    awk '/<handlehttp>/ {b=13; e=(length($0)-25); print substr($0,b,e)}')
-    echo "$pid, $handle" >> result.csv
-done 
+# Looks up the handle for each PID read from standard input, appending
+# "pid, handle" lines to result.csv. This is now done by handles.py, which runs
+# the lookups concurrently and answers repeat lookups from its local cache.
+
+python3 "$(dirname "$0")/../handles.py" list
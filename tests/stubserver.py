@@ -0,0 +1,123 @@
+############################################################################
+#                                                                          #
+#                             STUBSERVER.PY:                               #
+#          A stand-in Fedora server for the tests, run in a thread         #
+#                                                                          #
+############################################################################
+#                                                                          #
+# StubFedora listens on a free local port and answers the requests the     #
+# tools make of Fedora: getNextPID, handle lookups and ingests. It records #
+# every request in the order received, and can be told to answer requests  #
+# with server errors, to refuse the ingest of given PIDs, or to ingest an  #
+# object but lose the response, as a timed-out request would.              #
+#                                                                          #
+############################################################################
+
+
+import http.server
+import itertools
+import os
+import sys
+import threading
+import urllib.parse
+
+# The tests import the tools from the directory above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Answers each request from the state of the StubFedora it belongs to.
+class StubHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    fedora = None
+
+    def reply(self, status, body, contentType='text/xml'):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        status = self.fedora.record('GET', url.path, query)
+        if status is not None:
+            self.reply(status, 'Service unavailable', 'text/plain')
+        elif url.path.endswith('/getNextPID'):
+            pids = self.fedora.reservePids(int(query['numPids'][0]))
+            self.reply(200, '<?xml version="1.0" encoding="UTF-8"?>\n<pidList>\n{0}</pidList>\n'
+                       .format(''.join('  <pid>{0}</pid>\n'.format(pid) for pid in pids)))
+        elif url.path.startswith('/handle'):
+            handle = self.fedora.handles.get(query['pid'][0])
+            self.reply(200, '<result>\n<pid>{0}</pid>\n{1}</result>\n'.format(
+                query['pid'][0], '' if handle is None else
+                '<handlehttp>{0}</handlehttp>\n'.format(handle)))
+        else:
+            self.reply(404, 'Not found', 'text/plain')
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        url = urllib.parse.urlparse(self.path)
+        pid = urllib.parse.unquote(url.path.rsplit('/', 1)[-1])
+        status = self.fedora.record('POST', url.path, urllib.parse.parse_qs(url.query))
+        if status is not None:
+            self.reply(status, 'Service unavailable', 'text/plain')
+            return
+        with self.fedora.lock:
+            if pid in self.fedora.rejected:
+                self.reply(400, 'Invalid FOXML for {0}'.format(pid), 'text/plain')
+            elif pid in self.fedora.objects:
+                self.reply(500, 'org.fcrepo.server.errors.ObjectExistsException: The PID '
+                           "'{0}' already exists in the registry".format(pid), 'text/plain')
+            else:
+                self.fedora.objects[pid] = data
+                if pid in self.fedora.lostResponses:
+                    self.fedora.lostResponses.discard(pid)
+                    self.reply(503, 'Service unavailable', 'text/plain')
+                else:
+                    self.reply(201, pid, 'text/plain')
+
+    def log_message(self, format, *args):
+        pass
+
+
+# A stub Fedora server running in a background thread until closed. Its URL is
+# the address of the server, to which the tools' paths are added.
+class StubFedora:
+
+    def __init__(self):
+        self.requests = []          # (method, path, query) of each request
+        self.failures = []          # statuses to answer the next requests with
+        self.objects = {}           # the FOXML ingested, keyed by PID
+        self.rejected = set()       # PIDs whose ingest is refused
+        self.lostResponses = set()  # PIDs whose next ingest succeeds but answers 503
+        self.handles = {}           # the handle of each PID that has one
+        self.pidNumbers = itertools.count(1)
+        self.lock = threading.Lock()
+        handler = type('Handler', (StubHandler,), {'fedora': self})
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,),
+                                       daemon=True)
+        self.thread.start()
+
+    # Records a request, returning the status to fail it with, if any.
+    def record(self, method, path, query):
+        with self.lock:
+            self.requests.append((method, path, query))
+            return self.failures.pop(0) if self.failures else None
+
+    def reservePids(self, count):
+        with self.lock:
+            return ['umd:{0}'.format(next(self.pidNumbers)) for i in range(count)]
+
+    # The PIDs posted for ingest, in the order received.
+    def posted(self):
+        return [urllib.parse.unquote(path.rsplit('/', 1)[-1])
+                for method, path, query in self.requests if method == 'POST']
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,55 @@
+import unittest
+
+import common
+import xmlgen3
+
+
+class NormalizeDateTest(unittest.TestCase):
+
+    def test_single_dates(self):
+        for value in ('1960', '1960-07', '1960-07-04'):
+            self.assertEqual(common.normalizeDate(value, ''),
+                             {'certainty': 'exact',
+                              'dates': ({'value': value, 'begin': None, 'end': None},)})
+
+    def test_circa_and_multiple_dates(self):
+        result = common.normalizeDate('1960; 1962-05', 'multiple circa')
+        self.assertEqual(result['certainty'], 'circa')
+        self.assertEqual([date['value'] for date in result['dates']], ['1960', '1962-05'])
+
+    def test_ranges_keep_their_endpoints(self):
+        result = common.normalizeDate('1901-01-01-1902-02-02', 'range')
+        self.assertEqual(result['dates'], ({'value': '1901-01-01-1902-02-02',
+                                            'begin': '1901-01-01', 'end': '1902-02-02'},))
+        result = common.normalizeDate('1960 - 1969', 'range')
+        self.assertEqual((result['dates'][0]['begin'], result['dates'][0]['end']),
+                         ('1960', '1969'))
+
+    def test_an_empty_date_is_allowed(self):
+        self.assertEqual(common.normalizeDate('', '')['dates'],
+                         ({'value': '', 'begin': None, 'end': None},))
+
+    def test_bad_dates_are_refused(self):
+        for value, attribute in (('July 1960', ''), ('1960-13', ''), ('1961-02-29', ''),
+                                 ('1960', 'range'), ('1969-1960', 'range'),
+                                 ('1960-1961-02-30', 'range')):
+            with self.assertRaises(ValueError):
+                common.normalizeDate(value, attribute)
+
+
+class GenerateDateTagTest(unittest.TestCase):
+
+    def test_date_and_century_tags(self):
+        self.assertEqual(xmlgen3.generateDateTag('1899-1901', 'range circa',
+                                                 '20th century;19th century'),
+                         '<century certainty="exact" era="ad">19th century</century>\n'
+                         '<century certainty="exact" era="ad">20th century</century>\n'
+                         '<date certainty="circa" era="ad" from="1899" to="1901">'
+                         '1899-1901</date>')
+        self.assertEqual(xmlgen3.generateDateTag('1960-07-04', 'exact', '20th century'),
+                         '<century certainty="exact" era="ad">20th century</century>\n'
+                         '<date certainty="exact" era="ad">1960-07-04</date>')
+
+
+if __name__ == '__main__':
+    unittest.main()
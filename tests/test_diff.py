@@ -0,0 +1,98 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+import common
+import xmlgen3
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ObjectDigestTest(unittest.TestCase):
+
+    def test_timestamps_are_left_out(self):
+        first = ('<foxml:datastream CREATED="2026-01-01T10:00:00.000001Z"/>\n'
+                 '<foxml:datastream CREATED="2026-01-01T10:00:00.000001Z"/>')
+        second = first.replace('10:00:00.000001', '11:30:12.345678')
+        self.assertEqual(xmlgen3.objectDigest(first), xmlgen3.objectDigest(second))
+        self.assertNotEqual(xmlgen3.objectDigest(first),
+                            xmlgen3.objectDigest(first.replace('datastream', 'object')))
+
+    def test_content_without_timestamps(self):
+        self.assertEqual(xmlgen3.objectDigest('<a/>'), xmlgen3.objectDigest('<a/>'))
+        self.assertNotEqual(xmlgen3.objectDigest('<a/>'), xmlgen3.objectDigest('<b/>'))
+
+
+# Generates a batch and then compares a second run against it, as --diff does.
+class DiffRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(repoDir)           # the templates are read from templates/
+        common.verbosity = common.QUIET
+        self.dataFile = os.path.join(self.tempDir, 'batch.csv')
+        benchmark.generateData(self.dataFile, 9, parts=2)
+        self.pids = ['test:{0}'.format(n) for n in range(1, 10)]
+        self.batch = xmlgen3.setupBatch({'rights': 'P', 'mediaType': 'V',
+                                         'collection': 'D', 'timeFormat': 'I'})
+        self.firstRun = self.generate('first')
+
+    def tearDown(self):
+        common.verbosity = common.NORMAL
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempDir)
+
+    # Generates the data file into a new output directory, comparing it with the
+    # objects of an earlier run if given. Returns the output directory.
+    def generate(self, name, previous=None):
+        outputDir = os.path.join(self.tempDir, name)
+        xmlgen3.setup_output_dirs(outputDir)
+        run = {'dataFile': self.dataFile, 'arrangement': 'M',
+               'answers': xmlgen3.batchAnswers(self.batch), 'pids': self.pids}
+        manifest = xmlgen3.startManifest(run, outputDir=outputDir)
+        xmlgen3.runBatch(self.batch, xmlgen3.readData(self.dataFile), 'M', self.pids,
+                         outputDir, manifest=manifest, previous=previous)
+        manifest.close()
+        return outputDir
+
+    # Changes a column of one row of the data file.
+    def editData(self, rowNumber, column, value):
+        with open(self.dataFile, newline='') as f:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+        rows[rowNumber][column] = value
+        with open(self.dataFile, 'w', newline='') as f:
+            writer = csv.DictWriter(f, reader.fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def changedObjects(self, outputDir):
+        with open(os.path.join(outputDir, 'changed.txt')) as f:
+            changed = f.read().split()
+        self.assertEqual(sorted(os.listdir(os.path.join(outputDir, 'foxml'))),
+                         sorted(pid.replace(':', '_') + '.xml' for pid in changed))
+        return set(changed)
+
+    def test_unchanged_data_writes_nothing(self):
+        run, previous = xmlgen3.loadDigests(self.firstRun)
+        self.assertEqual(len(previous), 9)
+        self.assertEqual(self.changedObjects(self.generate('second', previous)), set())
+
+    def test_only_changed_objects_are_written(self):
+        run, records = common.readManifest(os.path.join(self.firstRun, common.manifestFile))
+        # A new title for the second UMDM, and a new runtime for the last part,
+        # which also changes the summed runtime in its UMDM
+        self.editData(3, 'Title', 'A new title')
+        self.editData(8, 'DurationDerivatives', '03:00:00')
+        run, previous = xmlgen3.loadDigests(self.firstRun)
+        self.assertEqual(self.changedObjects(self.generate('second', previous)),
+                         {records[1]['pids'][-1], records[2]['pids'][1],
+                          records[2]['pids'][-1]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import common
+import xmlgen3
+
+
+class ParseDurationTest(unittest.TestCase):
+
+    def test_runtimes_are_read_as_milliseconds(self):
+        self.assertEqual(common.parseDuration('01:02:03'), 3723000)
+        self.assertEqual(common.parseDuration(' 00:00:07 '), 7000)
+        self.assertEqual(common.parseDuration('123:00:00'), 123 * 3600000)
+
+    def test_fractions_of_a_second_are_read_to_the_millisecond(self):
+        self.assertEqual(common.parseDuration('00:00:01.5'), 1500)
+        self.assertEqual(common.parseDuration('00:00:01.05'), 1050)
+        self.assertEqual(common.parseDuration('00:00:01.2349'), 1234)
+
+    def test_unreadable_runtimes_are_refused(self):
+        for value in ('', '1:02', '01:02:03:04', 'one hour', '01:02:03.'):
+            with self.assertRaises(ValueError):
+                common.parseDuration(value)
+
+
+class FormatDurationTest(unittest.TestCase):
+
+    def test_milliseconds_are_shown_only_if_there_are_any(self):
+        self.assertEqual(common.formatDuration(3723000), '01:02:03')
+        self.assertEqual(common.formatDuration(3723050), '01:02:03.050')
+        self.assertEqual(common.formatDuration(0), '00:00:00')
+
+    def test_sums_of_a_day_or_more_are_not_wrapped(self):
+        summed = sum(common.parseDuration(value) for value in
+                     ('20:00:00', '05:30:00.250', '00:29:59.750'))
+        self.assertEqual(common.formatDuration(summed), '26:00:00')
+        self.assertEqual(common.formatDuration(common.parseDuration('100:00:01')),
+                         '100:00:01')
+
+    def test_runtimes_round_trip(self):
+        for value in ('00:00:00', '01:59:59', '23:59:59.999', '48:00:00.001'):
+            self.assertEqual(common.formatDuration(common.parseDuration(value)), value)
+
+
+class FormatRunTimeTest(unittest.TestCase):
+
+    def test_runtimes_in_minutes(self):
+        self.assertEqual(xmlgen3.formatRunTime(common.parseDuration('01:30:00'), 'minutes'),
+                         '90.0')
+        self.assertEqual(xmlgen3.formatRunTime(common.parseDuration('00:00:20'), 'minutes'),
+                         '0.33')
+        self.assertEqual(xmlgen3.formatRunTime(common.parseDuration('25:00:00'), 'minutes'),
+                         '1500.0')
+
+    def test_runtimes_in_hours_minutes_and_seconds(self):
+        self.assertEqual(xmlgen3.formatRunTime(common.parseDuration('25:00:00'), 'hh:mm:ss'),
+                         '25:00:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
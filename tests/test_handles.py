@@ -0,0 +1,68 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from stubserver import StubFedora
+
+import handles
+
+
+class LookupHandlesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fedora = StubFedora()
+        self.fedora.handles = {'umd:1': 'http://hdl.handle.net/1903.1/1',
+                               'umd:2': 'http://hdl.handle.net/1903.1/2'}
+        self.url = self.fedora.url + '/handle/'
+        self.tempDir = tempfile.mkdtemp()
+        self.cache = handles.openHandleCache(os.path.join(self.tempDir, 'handles.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        self.fedora.close()
+        shutil.rmtree(self.tempDir)
+
+    def test_handles_are_looked_up(self):
+        found = handles.lookupHandles(['umd:1', 'umd:2', 'umd:3'], 2, self.url)
+        self.assertEqual(found, {'umd:1': 'http://hdl.handle.net/1903.1/1',
+                                 'umd:2': 'http://hdl.handle.net/1903.1/2', 'umd:3': ''})
+        self.assertEqual(sorted(query['pid'][0] for method, path, query
+                                in self.fedora.requests), ['umd:1', 'umd:2', 'umd:3'])
+
+    def test_only_pids_with_handles_are_counted_as_found(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            handles.lookupHandles(['umd:1', 'umd:3', 'umd:4'], 2, self.url)
+        self.assertIn('Found 1 of 3 handles', output.getvalue())
+        self.assertIn('2 PIDs have no handle yet: umd:3, umd:4', output.getvalue())
+
+    def test_cached_handles_are_not_fetched_again(self):
+        pids = ['umd:1', 'umd:2', 'umd:3']
+        first = handles.lookupHandles(pids, 2, self.url, self.cache)
+        del self.fedora.requests[:]
+        second = handles.lookupHandles(pids, 2, self.url, self.cache)
+        self.assertEqual(first, second)
+        # Only the PID with no handle yet is looked up again
+        self.assertEqual([query['pid'][0] for method, path, query in self.fedora.requests],
+                         ['umd:3'])
+
+    def test_invalidated_handles_are_fetched_again(self):
+        handles.lookupHandles(['umd:1', 'umd:2'], 2, self.url, self.cache)
+        handles.invalidateHandles(self.cache, ['umd:1'])
+        del self.fedora.requests[:]
+        handles.lookupHandles(['umd:1', 'umd:2'], 2, self.url, self.cache)
+        self.assertEqual([query['pid'][0] for method, path, query in self.fedora.requests],
+                         ['umd:1'])
+
+    def test_lookups_are_retried_after_server_errors(self):
+        self.fedora.failures = [503, 503]
+        found = handles.lookupHandles(['umd:1'], 1, self.url)
+        self.assertEqual(found, {'umd:1': 'http://hdl.handle.net/1903.1/1'})
+        self.assertEqual(len(self.fedora.requests), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
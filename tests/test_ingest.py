@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from stubserver import StubFedora
+
+import common
+import ingest
+
+
+# Makes an object group as the generator hands it to the ingester: the parts
+# followed by the UMDM, as (pid, FOXML bytes) pairs.
+def makeGroup(*pids):
+    return [(pid, '<foxml:digitalObject PID="{0}"/>'.format(pid).encode('utf-8'))
+            for pid in pids]
+
+
+class IngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fedora = StubFedora()
+        self.url = self.fedora.url + '/fedora/objects/'
+        self.outputDir = tempfile.mkdtemp()
+        self.sleep = mock.patch.object(common.time, 'sleep')
+        self.sleep.start()
+
+    def tearDown(self):
+        self.sleep.stop()
+        self.fedora.close()
+        shutil.rmtree(self.outputDir)
+
+    def ingestGroups(self, groups, workers=2):
+        ingester = ingest.Ingester(self.url, 'user', 'secret', workers, self.outputDir)
+        for documents in groups:
+            ingester.submit(documents, documents[-1][0])
+        return ingester.close()
+
+    def ledger(self):
+        with open(os.path.join(self.outputDir, ingest.ledgerFile)) as f:
+            return [json.loads(line) for line in f]
+
+    def test_parts_are_ingested_before_their_umdm(self):
+        groups = [makeGroup('umd:1', 'umd:2', 'umd:3'), makeGroup('umd:4', 'umd:5'),
+                  makeGroup('umd:6', 'umd:7', 'umd:8', 'umd:9')]
+        counts = self.ingestGroups(groups)
+        self.assertEqual(counts['ingested'], 9)
+        posted = self.fedora.posted()
+        for documents in groups:
+            pids = [pid for pid, data in documents]
+            self.assertEqual([pid for pid in posted if pid in pids], pids)
+        self.assertEqual(self.fedora.objects['umd:3'], groups[0][2][1])
+
+    def test_failed_part_holds_back_the_umdm(self):
+        self.fedora.rejected.add('umd:2')
+        counts = self.ingestGroups([makeGroup('umd:1', 'umd:2', 'umd:3')])
+        self.assertEqual((counts['ingested'], counts['failed']), (1, 2))
+        self.assertNotIn('umd:3', self.fedora.posted())
+        self.assertEqual({e['pid']: e['status'] for e in self.ledger()},
+                         {'umd:1': 'ingested', 'umd:2': 'failed', 'umd:3': 'failed'})
+
+        # A re-run ingests only what the ledger does not record as ingested
+        self.fedora.rejected.clear()
+        del self.fedora.requests[:]
+        counts = self.ingestGroups([makeGroup('umd:1', 'umd:2', 'umd:3')])
+        self.assertEqual((counts['ingested'], counts['already']), (2, 1))
+        self.assertEqual(self.fedora.posted(), ['umd:2', 'umd:3'])
+
+    def test_group_of_changed_parts_keeps_its_umdm(self):
+        # Only the parts of umd:3 were written, so neither part is its UMDM
+        self.fedora.rejected.add('umd:1')
+        ingester = ingest.Ingester(self.url, 'user', 'secret', 1, self.outputDir)
+        ingester.submit(makeGroup('umd:1', 'umd:2'), 'umd:3')
+        counts = ingester.close()
+        self.assertEqual((counts['ingested'], counts['failed']), (1, 1))
+        self.assertEqual({e['pid']: e['status'] for e in self.ledger()},
+                         {'umd:1': 'failed', 'umd:2': 'ingested'})
+
+    def test_groups_are_read_from_the_manifest(self):
+        documents = makeGroup('umd:1', 'umd:2', 'umd:3', 'umd:4')
+        paths = {pid: common.outputPath(pid.replace(':', '_'), '.xml')
+                 for pid, data in documents}
+        os.makedirs(os.path.join(self.outputDir, 'foxml'))
+        for pid, data in documents:
+            with open(os.path.join(self.outputDir, paths[pid]), 'wb') as f:
+                f.write(data)
+        # Only the changed part of the second group, umd:3, was written by the run
+        records = [{'pids': ['umd:1', 'umd:2', 'umd:3', 'umd:4']},
+                   {'group': 1, 'pids': ['umd:1', 'umd:2'],
+                    'files': {paths['umd:1']: '', paths['umd:2']: ''}},
+                   {'group': 2, 'pids': ['umd:3', 'umd:4'], 'files': {paths['umd:3']: ''}}]
+        with open(os.path.join(self.outputDir, common.manifestFile), 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+        self.assertEqual(list(ingest.readGroups(self.outputDir)),
+                         [(documents[:2], 'umd:2'), (documents[2:3], 'umd:4')])
+
+    def test_server_errors_are_retried(self):
+        self.fedora.failures = [503, 502]
+        counts = self.ingestGroups([makeGroup('umd:1', 'umd:2')], workers=1)
+        self.assertEqual(counts['ingested'], 2)
+        self.assertEqual(self.fedora.posted(), ['umd:1', 'umd:1', 'umd:1', 'umd:2'])
+
+    def test_object_found_on_retry_counts_as_ingested(self):
+        self.fedora.lostResponses.add('umd:1')
+        counts = self.ingestGroups([makeGroup('umd:1', 'umd:2')])
+        self.assertEqual((counts['ingested'], counts['failed']), (2, 0))
+        self.assertEqual(self.fedora.posted(), ['umd:1', 'umd:1', 'umd:2'])
+
+    def test_object_existing_beforehand_fails(self):
+        self.fedora.objects['umd:1'] = b'<foxml:digitalObject/>'
+        counts = self.ingestGroups([makeGroup('umd:1', 'umd:2')])
+        self.assertEqual(counts['failed'], 2)
+        self.assertEqual(self.fedora.posted(), ['umd:1'])
+
+    def test_ingest_session_does_not_retry_posts_itself(self):
+        session = common.fedoraSession(poolSize=1)
+        retry = session.get_adapter(self.url).max_retries
+        self.assertFalse(retry.is_retry('POST', 503))
+        self.assertTrue(retry.is_retry('GET', 503))
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+import xmlgen3
+
+
+class CheckJobTest(unittest.TestCase):
+
+    def test_choices_are_normalized(self):
+        self.assertEqual(xmlgen3.checkJob({'rights': 'p', 'timeFormat': 'i', 'workers': 4}),
+                         {'rights': 'P', 'timeFormat': 'I', 'workers': 4})
+
+    def test_numbers_given_as_text_are_refused(self):
+        for job in ({'workers': '4'}, {'pidChunkSize': '1000'}, {'writerThreads': '2'},
+                    {'ingestWorkers': 2.5}, {'handleWorkers': True}):
+            with self.assertRaises(SystemExit):
+                xmlgen3.checkJob(job)
+
+    def test_numbers_below_the_smallest_value_are_refused(self):
+        with self.assertRaises(SystemExit):
+            xmlgen3.checkJob({'workers': 0})
+        self.assertEqual(xmlgen3.checkJob({'writerThreads': 0}), {'writerThreads': 0})
+
+    def test_collection_may_be_a_choice_or_a_pid(self):
+        self.assertEqual(xmlgen3.checkJob({'collection': 'umd:3392'}),
+                         {'collection': 'umd:3392'})
+        self.assertEqual(xmlgen3.checkJob({'collection': 'f'}), {'collection': 'F'})
+        with self.assertRaises(SystemExit):
+            xmlgen3.checkJob({'collection': 5})
+
+
+if __name__ == '__main__':
+    unittest.main()
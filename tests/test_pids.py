@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from stubserver import StubFedora
+
+import common
+import xmlgen3
+
+
+class RequestPidsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fedora = StubFedora()
+        self.outputDir = tempfile.mkdtemp()
+        self.job = {'pidServerUrl': self.fedora.url + '/fedora/management/getNextPID',
+                    'username': 'user', 'password': 'secret', 'pidChunkSize': 10}
+        self.sleep = mock.patch.object(common.time, 'sleep')
+        self.sleep.start()
+
+    def tearDown(self):
+        self.sleep.stop()
+        self.fedora.close()
+        shutil.rmtree(self.outputDir)
+
+    def test_pids_are_requested_in_chunks(self):
+        pids = xmlgen3.requestPids(25, self.job, self.outputDir)
+        self.assertEqual(pids, ['umd:{0}'.format(n) for n in range(1, 26)])
+        self.assertEqual([query['numPids'] for method, path, query in self.fedora.requests],
+                         [['10'], ['10'], ['5']])
+        self.assertEqual(xmlgen3.parsePids(os.path.join(self.outputDir, 'pids.xml')), pids)
+
+    def test_failed_chunk_is_requested_again(self):
+        self.fedora.failures = [503]
+        pids = xmlgen3.requestPids(15, self.job, self.outputDir)
+        self.assertEqual(len(pids), 15)
+        self.assertEqual(len(set(pids)), 15)
+        self.assertEqual(len(self.fedora.requests), 3)
+
+
+    def test_duplicate_pids_abort_the_run(self):
+        with self.assertRaises(SystemExit):
+            xmlgen3.checkPids(['umd:1', 'umd:2', 'umd:1'], 3)
+        # A PID listed again beyond those needed is never used, so is allowed
+        xmlgen3.checkPids(['umd:1', 'umd:2', 'umd:3', 'umd:1'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
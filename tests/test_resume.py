@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+import common
+import xmlgen3
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Generates a batch of three object groups with its checkpoint manifest, and
+# checks what a resumed run finds intact after the output has been damaged.
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(repoDir)           # the templates are read from templates/
+        common.verbosity = common.QUIET
+        self.dataFile = os.path.join(self.tempDir, 'batch.csv')
+        benchmark.generateData(self.dataFile, 9, parts=2)
+        self.outputDir = os.path.join(self.tempDir, 'output')
+        self.manifestPath = os.path.join(self.outputDir, common.manifestFile)
+        self.batch = xmlgen3.setupBatch({'rights': 'P', 'mediaType': 'V',
+                                         'collection': 'D', 'timeFormat': 'I'})
+        self.run = {'dataFile': self.dataFile, 'arrangement': 'M',
+                    'answers': xmlgen3.batchAnswers(self.batch),
+                    'pids': ['test:{0}'.format(n) for n in range(1, 10)]}
+        xmlgen3.setup_output_dirs(self.outputDir)
+        self.generate()
+
+    def tearDown(self):
+        common.verbosity = common.NORMAL
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempDir)
+
+    # Generates the groups not already completed, as runJob does when resuming.
+    def generate(self, completed=()):
+        manifest = xmlgen3.startManifest(self.run, completed, self.outputDir)
+        result = xmlgen3.runBatch(self.batch, xmlgen3.readData(self.dataFile), 'M',
+                                  self.run['pids'], self.outputDir, manifest=manifest,
+                                  skip=len(completed))
+        manifest.close()
+        return result
+
+    # The path of one of the files written for a group, in order of file name.
+    def objectFile(self, group, number):
+        run, records = common.readManifest(self.manifestPath)
+        return os.path.join(self.outputDir, sorted(records[group]['files'])[number])
+
+    def completedGroups(self):
+        run, completed = xmlgen3.loadManifest(self.outputDir)
+        self.assertEqual(run, self.run)
+        return [record['group'] for record in completed]
+
+    def test_intact_run_is_complete(self):
+        self.assertEqual(self.completedGroups(), [1, 2, 3])
+
+    def test_truncated_manifest_line_is_ignored(self):
+        with open(self.manifestPath) as f:
+            text = f.read()
+        with open(self.manifestPath, 'w') as f:
+            f.write(text[:-20])
+        self.assertEqual(self.completedGroups(), [1, 2])
+
+    def test_damaged_or_missing_file_stops_the_check(self):
+        with open(self.objectFile(1, 0), 'a') as f:
+            f.write('<!-- damaged -->')
+        self.assertEqual(self.completedGroups(), [1])
+        os.remove(self.objectFile(0, 2))
+        self.assertEqual(self.completedGroups(), [])
+
+    def test_resumed_run_regenerates_the_damaged_groups(self):
+        damaged = self.objectFile(1, 0)
+        with open(damaged, 'w') as f:
+            f.write('<partial')
+        run, completed = xmlgen3.loadManifest(self.outputDir)
+        result = self.generate(completed)
+        # The six objects of the last two groups are written, and the four lists
+        self.assertEqual((result['groups'], result['files']), (3, 10))
+        self.assertEqual(self.completedGroups(), [1, 2, 3])
+        with open(damaged) as f:
+            self.assertTrue(f.read().startswith('<?xml'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,34 +1,197 @@
 #!/usr/bin/env python3
 
-import sys, subprocess
-
-required_columns =[ "Accession", "AlternateTitle", "ArchivalCollection", "AspectRatio",
-                    "Box", "Century", "Color", "Continent", "Contributor", 
-                    "ContributorType", "CopyrightHolder", "CorpScheme", "CorpSubject", 
-                    "Country", "Creator", "CreatorType", "DataRate", "DateAttribute", 
-                    "DateCreated", "DateDigitized", "Department", "Description/Summary", 
-                    "DigitizationNotes", "DigitizedByDept", "DigitizedByPers", 
-                    "Dimensions", "DurationDerivatives", "FileName", "Form", "Format", 
-                    "FormType", "FrameRate", "GeographicalScheme", "GeographicalSubject", 
-                    "HorizontalPixels", "Identifier", "Item", "Language", "MediaType", 
-                    "Mono/Stereo", "PersonalScheme", "PersonalSubject", 
-                    "Provider/Publisher", "Provider/PublisherType", "Region/State", 
-                    "RepositoryBrowse", "Rights", "ScanSignal", "Series", 
-                    "Settlement/City", "SharestreamURLs", "Subseries", "Title", 
-                    "TopicalScheme", "TopicalSubject", "TrackFormat", "VerticalPixels", 
-                    "VideoStandard", "XMLType" ]
-
-bashCommand = "in2csv {0}".format(sys.argv[1])
-
-bashout = subprocess.check_output(bashCommand.split())
-
-firstline = bashout.decode('utf-8').split('\n')[0]
-
-columns_to_check = sorted(firstline.split(','))
-
-for c in required_columns:
-    if c in columns_to_check:
-        print("Found {0}!".format(c))
+############################################################################
+#                                                                          #
+#                              VALIDATE.PY:                                #
+#          Checks a CSV data file before any PIDs are reserved for it      #
+#                                                                          #
+############################################################################
+#                                                                          #
+# Usage:                                                                   #
+#                                                                          #
+#     python3 validate.py batch1.csv [--arrangement S] [--media-type V]    #
+#                                                                          #
+# The file (CSV, or an Excel workbook ending in .xlsx) is read once,       #
+# checking that every required column is present and that each row holds   #
+# what the XML generator expects: matching counts of agents and agent      #
+# types and of subjects and schemes, dates in a form the generator can     #
+# read, a readable DurationDerivatives for every part, and UMDM/UMAM rows  #
+# in a usable order for multi-rowed data. Every problem is reported with   #
+# its row number (the header being row 1). xmlgen3.py runs the same checks #
+# before requesting or loading PIDs.                                       #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import sys
+
+import common
+
+
+required_columns =[ "Accession", "AlternateTitle", "ArchivalCollection", "Box",
+                    "Century", "Continent", "Contributor", "ContributorType",
+                    "CopyrightHolder", "CorpScheme", "CorpSubject", "Country",
+                    "Creator", "CreatorType", "DateAttribute", "DateCreated",
+                    "DateDigitized", "Department", "Description/Summary",
+                    "DigitizationNotes", "DigitizedByDept", "DigitizedByPers",
+                    "Dimensions", "DurationDerivatives", "FileName", "Form", "Format",
+                    "FormType", "GeographicalScheme", "GeographicalSubject",
+                    "Identifier", "Item", "Language", "MediaType", "Mono/Stereo",
+                    "PersonalScheme", "PersonalSubject", "Provider/Publisher",
+                    "Provider/PublisherType", "Region/State", "RepositoryBrowse",
+                    "Rights", "Series", "Settlement/City", "SharestreamURLs",
+                    "Subseries", "Title", "TopicalScheme", "TopicalSubject",
+                    "TrackFormat", "XMLType" ]
+
+# The columns read only for video, as buildTechnicalMeta does, and required only
+# when the batch is known to be video (media type V)
+video_columns = [ "AspectRatio", "Color", "DataRate", "FrameRate", "HorizontalPixels",
+                  "ScanSignal", "VerticalPixels", "VideoStandard" ]
+
+# The agent columns and their type columns, as read by generateAgentElements
+agent_columns = [ ("Creator", "CreatorType"),
+                  ("Contributor", "ContributorType"),
+                  ("Provider/Publisher", "Provider/PublisherType") ]
+
+# The subject columns and their scheme columns, as read by generateTopicalSubjects
+subject_columns = [ ("PersonalSubject", "PersonalScheme"),
+                    ("CorpSubject", "CorpScheme"),
+                    ("TopicalSubject", "TopicalScheme"),
+                    ("GeographicalSubject", "GeographicalScheme") ]
+
+
+# Returns the required columns missing from the header, including the video
+# columns for a video batch (media type V).
+def checkColumns(header, mediaType=None):
+    required = required_columns + video_columns if mediaType == 'V' else required_columns
+    return [c for c in required if c not in header]
+
+
+# Returns the problems with the agent, subject and date columns of a UMDM row.
+def checkDescriptiveData(row):
+    errors = []
+    for agentColumn, typeColumn in agent_columns:
+        if row.get(agentColumn):
+            agents = row[agentColumn].split(';')
+            agentTypes = (row.get(typeColumn) or '').split(';')
+            if len(agents) != len(agentTypes):
+                errors.append('{0} agents in {1} but {2} types in {3}'.format(
+                    len(agents), agentColumn, len(agentTypes), typeColumn))
+            else:
+                for t in agentTypes:
+                    if t not in ('corpName', 'persName'):
+                        errors.append('Unknown agent type in {0}: "{1}" '
+                                      '(expected corpName or persName)'.format(typeColumn, t))
+    for subjectColumn, schemeColumn in subject_columns:
+        if row.get(subjectColumn):
+            subjects = row[subjectColumn].split(';')
+            schemes = (row.get(schemeColumn) or '').split(';')
+            if len(subjects) != len(schemes) and len(schemes) != 1:
+                errors.append('{0} subjects in {1} but {2} schemes in {3}'.format(
+                    len(subjects), subjectColumn, len(schemes), schemeColumn))
+    try:
+        common.normalizeDate(row.get('DateCreated') or '', row.get('DateAttribute') or '')
+    except ValueError as e:
+        errors.append('Bad DateCreated: {0}'.format(e))
+    return errors
+
+
+# Returns the problems with the technical data of a UMAM row.
+def checkPartData(row):
+    errors = []
+    duration = row.get('DurationDerivatives')
+    try:
+        common.parseDuration(duration)
+    except (ValueError, TypeError):
+        errors.append('Unreadable DurationDerivatives: "{0}" '
+                      '(expected HH:MM:SS or HH:MM:SS.fff)'.format(duration))
+    return errors
+
+
+# Reads the data file once, checking the header and every row, and returns the
+# list of problems found as (row number, message) pairs, in row order, with the
+# header as row 1, the list of warnings in the same form, and the number of data
+# rows read, so that the file need not be read again to count them. For multi-
+# rowed data (arrangement M) the XMLType of each row is checked as well, as every
+# UMAM must follow the UMDM it belongs to. The video columns are required for
+# video (media type V), left out for audio (A), and only warned about when the
+# media type is not yet known.
+def validateFile(fileName, arrangement='M', mediaType=None):
+    errors = []
+    warnings = []
+    rowCount = 0
+    with common.openData(fileName) as reader:
+        header = reader.fieldnames or []
+        for c in checkColumns(header, mediaType):
+            errors.append((1, 'Required column {0} not found'.format(c)))
+        if mediaType is None:
+            for c in video_columns:
+                if c not in header:
+                    warnings.append((1, 'Column {0} not found (required for video)'.format(c)))
+        umdmRow = None      # row number of the UMDM whose parts are being read
+        parts = 0
+        for rowNumber, row in enumerate(reader, 2):
+            rowCount += 1
+            if None in row:
+                errors.append((rowNumber, 'Row has {0} fields but the header has {1}'.format(
+                    len(header) + len(row[None]), len(header))))
+            elif None in row.values():
+                errors.append((rowNumber, 'Row has {0} fields but the header has {1}'.format(
+                    len([v for v in row.values() if v is not None]), len(header))))
+                continue
+            if arrangement == 'S':
+                rowErrors = checkDescriptiveData(row) + checkPartData(row)
+            elif row.get('XMLType') == 'UMDM':
+                if umdmRow is not None and parts == 0:
+                    errors.append((umdmRow, 'UMDM row has no UMAM rows following it'))
+                umdmRow = rowNumber
+                parts = 0
+                rowErrors = checkDescriptiveData(row)
+            elif row.get('XMLType') == 'UMAM':
+                if umdmRow is None:
+                    errors.append((rowNumber, 'UMAM row found before any UMDM row'))
+                parts += 1
+                rowErrors = checkPartData(row)
+            else:
+                rowErrors = ['Unknown XMLType: "{0}" (expected UMDM or UMAM)'.format(
+                    row.get('XMLType'))]
+            errors.extend((rowNumber, e) for e in rowErrors)
+        if arrangement != 'S' and umdmRow is not None and parts == 0:
+            errors.append((umdmRow, 'UMDM row has no UMAM rows following it'))
+    errors.sort(key=lambda e: e[0])
+    return errors, warnings, rowCount
+
+
+# Validates the data file and prints every problem and warning found, returning
+# the list of problems and the number of data rows.
+def reportErrors(fileName, arrangement='M', mediaType=None):
+    common.say('\nChecking the data file {0}...'.format(fileName))
+    errors, warnings, rowCount = validateFile(fileName, arrangement, mediaType)
+    for rowNumber, message in warnings:
+        print('--> WARNING in row {0}: {1}'.format(rowNumber, message))
+    for rowNumber, message in errors:
+        print('--> ERROR in row {0}: {1}'.format(rowNumber, message))
+    if errors:
+        print('{0} problems found in {1}.'.format(len(errors), fileName))
     else:
-        print("--> ERROR: {0} not found!".format(c))
-    
+        common.say('No problems found.')
+    return errors, rowCount
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check a CSV data file for the XML generator before reserving PIDs.')
+    parser.add_argument('dataFile', help='CSV data file')
+    parser.add_argument('--arrangement', choices=('S', 'M'), default='M',
+        help='single (S) or multiple (M) rows for each object (default: M)')
+    parser.add_argument('--media-type', dest='mediaType', choices=('A', 'V'),
+        help='audio (A) or video (V); the video columns are required for video')
+    args = parser.parse_args()
+    errors, rowCount = reportErrors(args.dataFile, args.arrangement, args.mediaType)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
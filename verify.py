@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#                               VERIFY.PY:                                 #
+#            Checks the generated FOXML files before they are ingested     #
+#                                                                          #
+############################################################################
+#                                                                          #
+# Usage:                                                                   #
+#                                                                          #
+#     python3 verify.py output                                             #
+#     python3 verify.py batch1.tar.gz --schemas schemas/ --workers 4       #
+#                                                                          #
+# Every foxml/*.xml file in the output directory or archive is parsed to   #
+# check that it is well-formed. With --schemas, the XML content of each    #
+# datastream is also validated against the schema of the same name in the #
+# given directory (e.g. umdm.xsd, umam.xsd, rels-mets.xsd), where there is #
+# one. The files are checked in a pool of processes, each compiling the    #
+# schemas once, and the failures are written to a JSON report (by default  #
+# verify.json in the output directory, or beside the archive). xmlgen3.py  #
+# runs the same check after generating a batch when given --verify.        #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import collections
+import concurrent.futures
+import functools
+import json
+import os
+import sys
+import tarfile
+import zipfile
+from lxml import etree as etree
+
+import common
+
+
+# The FOXML namespace, for finding the datastreams in each document
+foxmlNamespace = {'foxml': 'info:fedora/fedora-system:def/foxml#'}
+
+# The parser used for the generated files, which never fetches anything from the
+# network or expands external entities
+foxmlParser = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+
+
+# Compiles the schema in a file, once per process.
+@functools.lru_cache(maxsize=None)
+def loadSchema(schemaPath):
+    return etree.XMLSchema(etree.parse(schemaPath, foxmlParser))
+
+
+# Returns the schema for a datastream ID from the schema directory, or None if
+# there is no schema for it.
+def datastreamSchema(schemaDir, datastreamId):
+    schemaPath = os.path.join(schemaDir, datastreamId + '.xsd')
+    if os.path.isfile(schemaPath):
+        return loadSchema(schemaPath)
+    return None
+
+
+# Checks one FOXML document, given as bytes, returning a list of failures. Each
+# failure is a dictionary giving the file, the datastream (if any), the line and
+# the message.
+def verifyDocument(name, data, schemaDir=None):
+    try:
+        root = etree.fromstring(data, foxmlParser)
+    except etree.XMLSyntaxError as e:
+        return [{'file': name, 'check': 'well-formed', 'datastream': None,
+                 'line': e.lineno, 'message': e.msg}]
+    failures = []
+    if schemaDir:
+        for datastream in root.iterfind('foxml:datastream', foxmlNamespace):
+            datastreamId = datastream.get('ID')
+            schema = datastreamSchema(schemaDir, datastreamId)
+            if schema is None:
+                continue
+            for content in datastream.iterfind(
+                    'foxml:datastreamVersion/foxml:xmlContent/*', foxmlNamespace):
+                if not schema.validate(content):
+                    for error in schema.error_log:
+                        failures.append({'file': name, 'check': 'schema',
+                                         'datastream': datastreamId,
+                                         'line': error.line, 'message': error.message})
+    return failures
+
+
+# Checks a chunk of documents in a worker process. Each item is a file name and
+# either the document's bytes or None, in which case the file is read from disk.
+def verifyChunk(items, schemaDir=None):
+    failures = []
+    for name, data in items:
+        if data is None:
+            with open(name, 'rb') as f:
+                data = f.read()
+        failures.extend(verifyDocument(name, data, schemaDir))
+    return len(items), failures
+
+
+# Lists the FOXML files in an output directory or archive, yielding each one's
+# name and, for archives, its bytes (files in a directory are read by the worker
+# that checks them).
+def readDocuments(source):
+    if os.path.isdir(source):
+        foxmlDir = os.path.join(source, 'foxml')
+        for fileName in sorted(os.listdir(foxmlDir)):
+            if fileName.endswith('.xml'):
+                yield os.path.join(foxmlDir, fileName), None
+    elif source.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            for name in archive.namelist():
+                if name.startswith('foxml/') and name.endswith('.xml'):
+                    yield name, archive.read(name)
+    else:
+        with tarfile.open(source, 'r:*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.startswith('foxml/') and \
+                        member.name.endswith('.xml'):
+                    yield member.name, archive.extractfile(member).read()
+
+
+# Groups the documents into chunks, so that each task sent to a worker process
+# is large enough to be worth sending.
+def chunked(items, chunkSize):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Checks every FOXML file in an output directory or archive, in a pool of worker
+# processes with a bounded number of chunks in flight. Returns the number of
+# files checked and the list of failures.
+def verifyOutput(source, workers=None, schemaDir=None, chunkSize=64):
+    workers = workers or os.cpu_count()
+    checked = 0
+    failures = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for chunk in chunked(readDocuments(source), chunkSize):
+            pending.append(executor.submit(verifyChunk, chunk, schemaDir))
+            if len(pending) >= workers * 4:
+                count, chunkFailures = pending.popleft().result()
+                checked += count
+                failures.extend(chunkFailures)
+        while pending:
+            count, chunkFailures = pending.popleft().result()
+            checked += count
+            failures.extend(chunkFailures)
+    return checked, failures
+
+
+# Writes the results of a check as a JSON report.
+def writeReport(reportPath, source, checked, failures):
+    with open(reportPath, 'w') as f:
+        json.dump({'source': source, 'checked': checked,
+                   'failedFiles': len(set(failure['file'] for failure in failures)),
+                   'failures': failures}, f, indent=2)
+        f.write('\n')
+
+
+# Checks an output directory or archive, printing a summary (even in quiet mode
+# if there are problems) and writing the report. Returns the list of failures.
+def verifyBatch(source, workers=None, schemaDir=None, reportPath=None):
+    if reportPath is None:
+        if os.path.isdir(source):
+            reportPath = os.path.join(source, 'verify.json')
+        else:
+            reportPath = source + '.verify.json'
+    common.say('\nVerifying the FOXML files in {0}...'.format(source))
+    checked, failures = verifyOutput(source, workers, schemaDir)
+    writeReport(reportPath, source, checked, failures)
+    for failure in failures[:20]:
+        print('--> ERROR in {0}{1}, line {2}: {3}'.format(
+            failure['file'],
+            ' ({0})'.format(failure['datastream']) if failure['datastream'] else '',
+            failure['line'], failure['message']))
+    if len(failures) > 20:
+        print('... and {0} more.'.format(len(failures) - 20))
+    common.say('Checked {0} files: {1} problems found. Report written to {2}'.format(
+        checked, len(failures), reportPath), common.QUIET if failures else common.NORMAL)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that generated FOXML files are well-formed, and optionally valid.')
+    parser.add_argument('source', help='output directory or archive written by xmlgen3.py')
+    parser.add_argument('--schemas', metavar='DIR',
+        help='directory of schemas named after datastream IDs (e.g. umdm.xsd)')
+    parser.add_argument('--workers', type=int, metavar='N',
+        help='number of processes to use (default: number of CPUs)')
+    parser.add_argument('--report', metavar='FILE',
+        help='JSON report to write (default: verify.json in the output directory, '
+             'or ARCHIVE.verify.json)')
+    args = parser.parse_args()
+    if verifyBatch(args.source, args.workers, args.schemas, args.report):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,30 +24,59 @@
 
 
 # Import needed modules
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
 import csv
 import datetime
-import isodate
+import functools
+import handles
+import hashlib
+import ingest
+import io
+import itertools
+import json
 import os
+import queue
 import re
-import requests
+import shutil
 import sys
+import tarfile
+import threading
+import time
+import uuid
+import validate
+import verify
+import zipfile
 from lxml import etree as etree
+try:
+    import tomllib      # Python 3.11 and later, for TOML job files
+except ImportError:
+    tomllib = None
+
+import common
+from common import (QUIET, NORMAL, VERBOSE, say, ask, fedoraSession, sendRequest, 
+                    fragmentCacheSize, parseDuration, formatDuration, normalizeDate, openData, 
+                    loadJoinTable, joinRows, reportJoin, outputPath, cleanContent, 
+                    manifestFile, readManifest)
 
 
 # Initiates interaction with the program and records the time and user.
-def greeting():
-    name = input("\nEnter your name: ")
-    print("\nHello " + name + ", welcome to the XML generator!")
+def greeting(name=None):
+    name = ask("\nEnter your name: ", name)
+    say("\nHello " + name + ", welcome to the XML generator!")
     currentTime = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-    print('It is now ' + str(currentTime))
-    print("\nThis program is designed to take data from a CSV file,")
-    print("and use that data to generate FOXML files for the")
-    print("University of Maryland's digital collections repository.")
+    say('It is now ' + str(currentTime))
+    say("\nThis program is designed to take data from a CSV file,")
+    say("and use that data to generate FOXML files for the")
+    say("University of Maryland's digital collections repository.")
 
 
 # Asks the user whether the batch is audio or video objects.
-def getMediaType():
-    mediaType = input('\nIs this a batch of [A]udio or [V]ideo? ')
+def getMediaType(answer=None):
+    mediaType = ask('\nIs this a batch of [A]udio or [V]ideo? ', answer)
     while mediaType not in ('A','V'):
         mediaType = input('Please enter A or V: ')
     if mediaType == "A":
@@ -56,28 +85,33 @@ def getMediaType():
         return "video"
 
 
-# Sets up the output directories and verifies they are empty
-def setup_output_dirs():
-    print("\nSetting up output directories...")
-    if not os.path.isdir('output'):
-        os.mkdir('output')
-    if not os.path.isdir('output/foxml'):
-        os.mkdir('output/foxml')
-    if not os.path.isdir('output/delObjects'):
-        os.mkdir('output/delObjects')
-    if (len([f for f in os.listdir('output') if not f.startswith('.')]) > 2 or 
-        len([f for f in os.listdir('output/foxml') if not f.startswith('.')]) > 0 or 
-        len([f for f in os.listdir('output/delObjects') if not f.startswith('.')]) > 0):
-        print("\toutput: ", os.listdir('output'))
-        print("\tfoxml: ", os.listdir('output/foxml'))
-        print("\tdelObjects: ", os.listdir('output/delObjects'))
+# Sets up the output directories and verifies they are empty, unless an
+# interrupted run in them is being resumed
+def setup_output_dirs(outputDir='output', resume=False):
+    say("\nSetting up output directories...")
+    foxmlDir = os.path.join(outputDir, 'foxml')
+    delObjectsDir = os.path.join(outputDir, 'delObjects')
+    os.makedirs(foxmlDir, exist_ok=True)
+    os.makedirs(delObjectsDir, exist_ok=True)
+    if resume:
+        return
+    if (len([f for f in os.listdir(outputDir) if not f.startswith('.')]) > 2 or 
+        len([f for f in os.listdir(foxmlDir) if not f.startswith('.')]) > 0 or 
+        len([f for f in os.listdir(delObjectsDir) if not f.startswith('.')]) > 0):
+        print("\toutput: ", os.listdir(outputDir))
+        print("\tfoxml: ", os.listdir(foxmlDir))
+        print("\tdelObjects: ", os.listdir(delObjectsDir))
         sys.exit("Output directories not empty.")
     return
 
 
-# Sets the governing collection
-def getCollection():
-    coll = input("\nChoose a collection -- [D]igital Collections, [A]lbUM, or [F]ilms@UM: ")
+# Sets the governing collection. A job may also name the collection PID directly.
+def getCollection(answer=None):
+    if answer is not None and ':' in answer:
+        say("\nUsing collection {0}".format(answer))
+        return answer
+    coll = ask("\nChoose a collection -- [D]igital Collections, [A]lbUM, or [F]ilms@UM: ", 
+               answer)
     while coll not in ('D','A','F'):
         coll = input('Please enter D, A, or F: ')
     if coll == "D":
@@ -88,112 +122,151 @@ def getCollection():
         return "umd:1158"
 
 
-# Analyzes the type of datafile and calculates the number of PIDs needed.
-def analyzeDataFile(dataFile):
-    dataFileSize = len(dataFile)
-    print('\nDoes your datafile contain single or multiple rows for each object?')
-    dataFileArrangement = input('Please enter S or M: ')
+# Asks whether the datafile has single or multiple rows for each object.
+def getArrangement(answer=None):
+    say('\nDoes your datafile contain single or multiple rows for each object?')
+    dataFileArrangement = ask('Please enter S or M: ', answer)
     while dataFileArrangement not in ('S','M'):
-        dataFileArrangement = input('Please enter either S for sigle-rowed',
+        dataFileArrangement = input('Please enter either S for sigle-rowed '
                                     'data, or M for multi-rowed data: ')
-    print('\nThe datafile you specified has {0} rows.'.format(dataFileSize + 1))
+    return dataFileArrangement
+
+
+# Calculates the number of PIDs needed for the number of data rows (as counted
+# when the datafile was checked) and the arrangement of the datafile.
+def analyzeDataFile(dataFileSize, dataFileArrangement):
+    say('\nThe datafile you specified has {0} rows.'.format(dataFileSize + 1))
     if dataFileArrangement == 'S':
-        print('Since you have single-rowed objects,'
-              'you need two PIDs for each row (excluding header).')
+        say('Since you have single-rowed objects,'
+            'you need two PIDs for each row (excluding header).')
         dataLength = dataFileSize * 2
     elif dataFileArrangement == 'M':
-        print('Since you have multi-rowed objects, you need one PID for each row.')
+        say('Since you have multi-rowed objects, you need one PID for each row.')
         dataLength = dataFileSize
-    print('Based on parsing the data file as a CSV',
-          'with a header row, it appears you need {0} PIDs.'.format(dataLength))
-    print('Load {0} PIDs from a file or request them from the server?'.format(dataLength))
-    return dataLength, dataFileArrangement
+    say('Based on parsing the data file as a CSV '
+        'with a header row, it appears you need {0} PIDs.'.format(dataLength))
+    say('Load {0} PIDs from a file or request them from the server?'.format(dataLength))
+    return dataLength
 
 
 # Reads the length of the CSV datafile and guides user in requesting
-# necessary number of PIDs from either the stage (for testing) or production server
-def getPids(dataLength):
-    pidList = []
-    pidSource = input('Enter F (file) or S (server): ')
+# necessary number of PIDs from either the stage (for testing) or production server.
+# Returns the list of PIDs.
+def getPids(dataLength, job, outputDir='output'):
+    if 'pidFile' in job:
+        pidSource = 'F'
+    elif 'pidServer' in job or 'pidServerUrl' in job:
+        pidSource = 'S'
+    else:
+        pidSource = None
+    pidSource = ask('Enter F (file) or S (server): ', pidSource)
     while (pidSource not in ('F','S')):
         print("ERROR: you must enter either 'F' to load PIDs from a file, " +
               "or 'S' to request them from the server!")
         pidSource = input('Please try again: ')
     if pidSource == 'F':
-        pidFileName = input('Enter the name of the PID file: ')
-        pidFile = open(pidFileName, 'r').read()
+        pidFileName = ask('Enter the name of the PID file: ', job.get('pidFile'))
+        pidList = parsePids(pidFileName)
     elif pidSource == 'S':
-        pidFile = requestPids(dataLength)
-    return pidFile
-
-
-# Handles the request for PIDs from the server, 
-# requesting a specified number of PIDs and saving the resulting XML file.
-def requestPids(numPids):                   
-    serverChoice = input('Enter S to get PIDs on fedoraStage, P to get PIDs on Production: ')
-    while (serverChoice not in ('S', 'P')): # Choose the production or stage server
-        serverChoice = input('Error: You must enter S or P: ')
-    if serverChoice == 'S':
-        url = 'http://fedorastage.lib.umd.edu/fedora/management/getNextPID?numPids='
-    elif serverChoice == 'P':
-        url = 'http://fedora.lib.umd.edu/fedora/management/getNextPID?numPids='
-    url += '{0}&namespace=umd&xml=true'.format(numPids)
-    username = input('\nEnter the server username: ')          # prompts user for auth info
-    password = input('Enter the server password: ')
-    f = requests.get(url, auth=(username, password)).text      # submits request to fedora server
-    print("\nRetrieving PIDs from the server...")
-    print('\nServer answered with the following XML file:\n')  # print server's response
-    print(f)
-    print('Saving the PID file as output/pids.xml: ')
-    writeFile("pids", f, '.xml')
-    return f
+        pidList = requestPids(dataLength, job, outputDir)
+    return pidList
+
+
+# The getNextPID endpoints of the stage and production servers
+pidServers = {
+    'S' : 'http://fedorastage.lib.umd.edu/fedora/management/getNextPID',
+    'P' : 'http://fedora.lib.umd.edu/fedora/management/getNextPID'
+    }
+
+
+# Handles the request for PIDs from the server, requesting the specified number of
+# PIDs in chunks over one session. The PIDs from each response are appended to
+# pids.xml in the output directory as they arrive, and the full list is returned.
+# A job may give the URL of the getNextPID endpoint directly (e.g. a local test 
+# server) in place of the stage/production choice. Each request reserves new 
+# PIDs, so it is retried explicitly after a server error: the PIDs of a lost 
+# response are left unused, and never handed out twice.
+def requestPids(numPids, job, outputDir='output'):
+    url = job.get('pidServerUrl')
+    if url is None:
+        serverChoice = ask('Enter S to get PIDs on fedoraStage, P to get PIDs on Production: ',
+                           job.get('pidServer'))
+        while (serverChoice not in ('S', 'P')): # Choose the production or stage server
+            serverChoice = input('Error: You must enter S or P: ')
+        url = pidServers[serverChoice]
+    username = ask('\nEnter the server username: ', job.get('username'))    # prompts user for auth info
+    password = ask('Enter the server password: ', job.get('password'), echo=False)
+    chunkSize = job.get('pidChunkSize', 1000)
+    session = fedoraSession(username, password, retries=0)
+    pidList = []
+    say("\nRetrieving {0} PIDs from the server in chunks of up to {1}...".format(
+        numPids, chunkSize))
+    say('Saving the PIDs as {0}'.format(os.path.join(outputDir, 'pids.xml')))
+    with open(os.path.join(outputDir, 'pids.xml'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<pidList>\n')
+        while len(pidList) < numPids:
+            params = {'numPids': min(chunkSize, numPids - len(pidList)), 
+                      'namespace': 'umd', 'xml': 'true'}
+            response, attempt = sendRequest(session, 'GET', url, params=params, timeout=60)
+            response.raise_for_status()
+            pids = list(readPids(io.BytesIO(response.content)))
+            if not pids:
+                sys.exit("The server's response contained no PIDs.")
+            for pid in pids:
+                f.write('\t<pid>{0}</pid>\n'.format(pid))
+            f.flush()
+            pidList.extend(pids)
+            say('\t{0} of {1} PIDs received'.format(len(pidList), numPids))
+        f.write('</pidList>\n')
+    session.close()
+    return pidList
+
+
+# Reads the PIDs from an XML-based PID file provided by Fedora (a file name or file 
+# object), one at a time as the file is parsed. Truncated files, such as one left 
+# by an interrupted request, are read as far as they go.
+def readPids(pidFile):
+    for event, element in etree.iterparse(pidFile, tag='{*}pid', recover=True):
+        if element.text:
+            yield element.text.strip()
+        element.clear()
 
 
 # Takes the XML-based PID file provided by Fedora, and parses it to retrieve just the pids,
 # loading them into a Python list and returning it.
 def parsePids(pidFile):
-    pidList = []                                        # create list to hold PIDs
-    for line in pidFile.splitlines():                   # for each line in the response
-        pid = re.search('<pid>(.*?)</pid>', line)       # search for PID and if found
-        if pid:
-            pidList.append(pid.group(1))                # append each PID to list
-    resultLength = str(len(pidList))
-    print('\nSuccessfully loaded the following {0} PIDs: '.format(resultLength))
-    print(pidList)
+    pidList = list(readPids(pidFile))
+    say('\nSuccessfully loaded {0} PIDs'.format(len(pidList)), end='')
+    if pidList:
+        say(': {0} ... {1}'.format(pidList[0], pidList[-1]), end='')
+    say()
     return pidList
 
 
+# The settings for each rights scheme that may govern access to a batch.
+rightsSchemes = {
+    'P' : {'amInfoStatus': 'Complete', 'doInfoStatus': 'Complete', 
+           'adminRightsAccess': 'UMDpublic'},
+    'R' : {'amInfoStatus': 'Complete', 'doInfoStatus': 'Private', 
+           'adminRightsAccess': 'UMDfilms00001'},
+    'C' : {'amInfoStatus': 'Complete', 'doInfoStatus': 'Complete', 
+           'adminRightsAccess': 'UMDfilms00001'},
+    'M' : {'amInfoStatus': 'Complete', 'doInfoStatus': 'Private', 
+           'adminRightsAccess': 'UMDfilms00001'}
+    }
+
+
 # Sets the rights scheme to govern access to this batch, based on user input.
-def getRightsScheme():
-    results = {}
-    print("\n[P]ublic = Accessible from anywhere, discoverable via search.")
-    print("[R]estricted = Accessible on campus only, not discoverable.")
-    print("[C]ampus Only = Accessible on campus only, discoverable via search.")
-    print("[M]ediated = Accessible from anywhere, not discoverable.")
-    schemeSelection = input(
-        "\nEnter the rights scheme to govern access to this batch [P, R, C, or M]: ")
-    while schemeSelection not in ["P", "R", "C", "M"]:
+def getRightsScheme(answer=None):
+    say("\n[P]ublic = Accessible from anywhere, discoverable via search.")
+    say("[R]estricted = Accessible on campus only, not discoverable.")
+    say("[C]ampus Only = Accessible on campus only, discoverable via search.")
+    say("[M]ediated = Accessible from anywhere, not discoverable.")
+    schemeSelection = ask(
+        "\nEnter the rights scheme to govern access to this batch [P, R, C, or M]: ", answer)
+    while schemeSelection not in rightsSchemes:
         schemeSelection = input("You must enter P, R, C, or M!")
-    if schemeSelection == "P":
-        results['amInfoStatus'] =           "Complete"
-        results['doInfoStatus'] =           "Complete"
-        results['adminRightsAccess'] =      "UMDpublic"
-    elif schemeSelection == "R":
-        results['amInfoStatus'] =           "Complete"
-        results['doInfoStatus'] =           "Private"
-        results['adminRightsAccess'] =      "UMDfilms00001"
-    elif schemeSelection == "C":
-        results['amInfoStatus'] =           "Complete"
-        results['doInfoStatus'] =           "Complete"
-        results['adminRightsAccess'] =      "UMDfilms00001"
-    elif schemeSelection == "M":
-        results['amInfoStatus'] =           "Complete"
-        results['doInfoStatus'] =           "Private"
-        results['adminRightsAccess'] =      "UMDfilms00001"
-    else:
-        print("Sorry, something went wrong with the rights selection!")
-        exit
-    return results
+    return dict(rightsSchemes[schemeSelection])
 
 
 # Generates the mediaType XML tag, wrapping it around the form XML tag      
@@ -209,11 +282,25 @@ def generateAgentsString(**kwargs):
         if dataCols:
             agentsList = generateAgentElements(dataCols[0], dataCols[1])
             for agent in agentsList:
-                result.append('<agent type="{0}">{1}</agent>'.format(type, 
-                                                                     agent))
+                result.append(agentFragment(type, agent))
     return "\n".join(result)
 
 
+# Returns the agent element for a name element, built once for each agent.
+@functools.lru_cache(maxsize=fragmentCacheSize)
+def agentFragment(type, agent):
+    return '<agent type="{0}">{1}</agent>'.format(type, agent)
+
+
+# Returns the name element for an agent of the given type ('corpName' or 
+# 'persName'), or None for any other type, built once for each agent.
+@functools.lru_cache(maxsize=fragmentCacheSize)
+def nameFragment(agent, agentType):
+    if agentType in ("corpName", "persName"):
+        return "<{0}>{1}</{0}>".format(agentType, agent)
+    return None
+
+
 # Generate list of agents from the data and type columns
 def generateAgentElements(agentColumn, agentTypeColumn):
     agents = agentColumn.split(";")
@@ -224,88 +311,55 @@ def generateAgentElements(agentColumn, agentTypeColumn):
                                                                agentTypeColumn
                                                                )
             )
+        return []
     else:
         result = []
-        agentData = zip(agents, agentTypes)
-        for a, t in agentData:
-            if t == "corpName":
-                result.append("<corpName>{0}</corpName>".format(a))
-            elif t == "persName":
-                result.append("<persName>{0}</persName>".format(a))
+        for a, t in zip(agents, agentTypes):
+            element = nameFragment(a, t)
+            if element is not None:
+                result.append(element)
         return result
 
 
-# Generates the specific XML tags based on dating information stored in the myDate dictionary
-# previously returned by the parseDate function.
+# Generates the century and date XML tags for an object from the structured dates
+# returned by normalizeDate. The tags are built once for each distinct combination
+# of date, date attribute and century. The from and to attributes of a range give
+# the years of its endpoints.
+@functools.lru_cache(maxsize=fragmentCacheSize)
 def generateDateTag(inputDate, inputAttribute, centuryData):
     dateTagList = generateCenturyTags(centuryData)  # start result list with century tag(s)
-    centuryList = []
-    myDate = parseDate(inputDate, inputAttribute)
-    if myDate['Type'] == 'range':
-        print(myDate['Value'])
-        elements = myDate['Value'].split('-')   # split the date into its parts
-        if len(elements) == 2:                  # if there are two parts, use those as begin/end years
-            beginDate = elements[0]
-            endDate = elements[1]
-        elif len(elements) == 4:
-            beginDate = elements[0]
-            endDate = elements[2]
-        elif len(elements) == 6:    # if there are 6 parts, use index 0 and 4 as begin/end years
-            beginDate = elements[0] # i.e. we assume YYYY-MM-DD-YYYY-MM-DD format for exact date ranges
-            endDate = elements[4]
-        myTag = '<date certainty="{0}" era="ad" from="{1}" to="{2}">{3}</date>'.format(myDate['Certainty'],
-                                                                                       beginDate, endDate,
-                                                                                       myDate['Value'])
-        dateTagList.append(myTag)
-    elif myDate['Number'] == 'multiple':
-        for i in myDate['Value']:
-            myTag = '<date certainty="{0}" era="ad">{1}</date>'.format(myDate['Certainty'], i.strip())
-            dateTagList.append(myTag)
-    else:
-        myTag = '<date certainty="{0}" era="ad">{1}</date>'.format(myDate['Certainty'], myDate['Value'])
+    myDate = normalizeDate(inputDate, inputAttribute)
+    for date in myDate['dates']:
+        if date['begin'] is None:
+            myTag = '<date certainty="{0}" era="ad">{1}</date>'.format(
+                myDate['certainty'], date['value'])
+        else:
+            myTag = '<date certainty="{0}" era="ad" from="{1}" to="{2}">{3}</date>'.format(
+                myDate['certainty'], date['begin'][:4], date['end'][:4], date['value'])
         dateTagList.append(myTag)
     return '\n'.join(dateTagList)
 
 
-# This function parses the date attributes stored in a particular column of the input data.
-def parseDate(inputDate, inputAttribute):
-    myDate = {}
-    if 'multiple' in inputAttribute:            # multiple or single date?
-        myDate['Number'] = 'multiple'
-    else:
-        myDate['Number'] = 'single'
-    if 'circa' in inputAttribute:               # exact or circa?
-        myDate['Certainty'] = 'circa'
-    else:
-        myDate['Certainty'] = 'exact'
-    if 'range' in inputAttribute:               # range or point?
-        myDate['Type'] = 'range'
-    else:
-        myDate['Type'] = 'date'
-    if myDate['Number'] == 'multiple':          # set value --> split if multiple, otherwise single value
-        myDate['Value'] = inputDate.split(';')
-    else:
-        myDate['Value'] = inputDate
-    return myDate
-
-
 # generate the sorted century tag(s) from the input data in the century column
 def generateCenturyTags(inputCentury):
-    result = []
-    myList = sorted(inputCentury.split(';'))
-    for i in myList:
-        result.append('<century certainty="exact" era="ad">{0}</century>'.format(
-            i.strip()))
-    return result
+    return [centuryFragment(i) for i in sorted(inputCentury.split(';'))]
+
+
+# Returns the century element for a century, built once for each century.
+@functools.lru_cache(maxsize=fragmentCacheSize)
+def centuryFragment(century):
+    return '<century certainty="exact" era="ad">{0}</century>'.format(century.strip())
 
 
 # generate browse terms from the subject field of the data
 def generateBrowseTerms(inputSubjects):
-    result = []
-    myList = inputSubjects.split(';')
-    for i in myList:
-        result.append('<subject type="browse">{0}</subject>'.format(i.strip()))
-    return '\n'.join(result)
+    return '\n'.join(browseFragment(i) for i in inputSubjects.split(';'))
+
+
+# Returns the browse subject element for a term, built once for each term.
+@functools.lru_cache(maxsize=fragmentCacheSize)
+def browseFragment(term):
+    return '<subject type="browse">{0}</subject>'.format(term.strip())
 
 
 # generate subject terms from the three subject columns of the data
@@ -326,52 +380,58 @@ def generateTopicalSubjects(**kwargs):
             else:
                 zipped = zip(value_list, scheme_list)
             
-            for subj in zipped:
-                # set up the attributes and labels
-                scheme = subj[1].strip()
-                if key == 'pers':
-                    element = '<persName>{0}</persName>'.format(subj[0].strip())
-                    type = 'topical'
-                
-                elif key == 'corp':
-                    element = '<corpName>{0}</corpName>'.format(subj[0].strip())
-                    type = 'topical'
-                
-                elif key == 'top':
-                    element = subj[0].strip()
-                    type = 'topical'
-                
-                elif key == 'geog':
-                    element = '<geogName>{0}</geogName>'.format(subj[0].strip())
-                    type = 'geographical'
-                
-                elif key == 'dec':
-                    element = ('<decade certainty="exact">' +
-                              '{0}</decade>'.format(subj[0].strip()))
-                    type = 'temporal'
-                
-                elif key == 'alb':
-                    element = subj[0].strip()
-                    label = 'AlbUM'
-                    type = 'browse'
-                    
-                # populate the subject element string
-                if scheme == 'AlbUM':
-                    subj_elem = ('<subject label="{0}" type='.format(label) +
-                                '"{0}">{1}</subject>'.format(type, element))
-                elif scheme != '':
-                    subj_elem = ('<subject scheme="{0}" type='.format(scheme) +
-                                '"{0}">{1}</subject>'.format(type, element))
-                elif scheme == '' or scheme is None:
-                    subj_elem = ('<subject type=' +
-                                '"{0}">{1}</subject>'.format(type, element))
-                        
-                # append the element to the list of subject elements
-                result.append(subj_elem)
+            for value, scheme in zipped:
+                result.append(subjectFragment(key, value, scheme))
                 
     return '\n'.join(result)
  
 
+# Returns the subject element for a value of the given kind ('pers', 'corp', 
+# 'top', 'geog', 'dec' or 'alb') and scheme, built once for each distinct value,
+# scheme and kind.
+@functools.lru_cache(maxsize=fragmentCacheSize)
+def subjectFragment(key, value, scheme):
+    # set up the attributes and labels
+    value = value.strip()
+    scheme = scheme.strip()
+    label = 'AlbUM'
+    if key == 'pers':
+        element = '<persName>{0}</persName>'.format(value)
+        type = 'topical'
+    
+    elif key == 'corp':
+        element = '<corpName>{0}</corpName>'.format(value)
+        type = 'topical'
+    
+    elif key == 'top':
+        element = value
+        type = 'topical'
+    
+    elif key == 'geog':
+        element = '<geogName>{0}</geogName>'.format(value)
+        type = 'geographical'
+    
+    elif key == 'dec':
+        element = ('<decade certainty="exact">' +
+                  '{0}</decade>'.format(value))
+        type = 'temporal'
+    
+    elif key == 'alb':
+        element = value
+        type = 'browse'
+        
+    # populate the subject element string
+    if scheme == 'AlbUM':
+        return ('<subject label="{0}" type='.format(label) +
+                '"{0}">{1}</subject>'.format(type, element))
+    elif scheme != '':
+        return ('<subject scheme="{0}" type='.format(scheme) +
+                '"{0}">{1}</subject>'.format(type, element))
+    else:
+        return ('<subject type=' +
+                '"{0}">{1}</subject>'.format(type, element))
+
+
 # generate block os XML relating to archival location
 def generateArchivalLocation(collection, **kwargs):
     result = ['<title type="main">{0}</title>'.format(collection)]
@@ -383,66 +443,575 @@ def generateArchivalLocation(collection, **kwargs):
 
 
 # Prompts the user to enter the name of the UMAM or UMDM template or PID file and
-# read that file, returning the contents.
-def loadFile(fileType):
+# read that file, returning the contents. Data files are not read up front; 
+# instead a lazy iterator over their rows is returned.
+def loadFile(fileType, answer=None):
     if fileType in ['umam','umdm']:
         sourceFile = "templates/{}.xml".format(fileType)
         f = open(sourceFile, 'r').read()
     else:
-        sourceFile = input("\nEnter the name of the {0} file: ".format(fileType))
+        sourceFile = ask("\nEnter the name of the {0} file: ".format(fileType), answer)
         if fileType == 'data':
-            f = open(sourceFile, 'r').readlines()
+            f = readData(sourceFile)
         else:
             f = open(sourceFile, 'r').read()
     return(f, sourceFile)
 
 
+# Reads the data file lazily, yielding one row at a time as a dictionary, with
+# any omitted optional columns added.
+def readData(fileName):
+    with openData(fileName) as reader:
+        for row in reader:
+            row.setdefault('AlbumDecade', None)
+            row.setdefault('AlbumBrowse', None)
+            yield row
+
+
+# The columns of a Sharestream asset export joined onto the data: the links are
+# keyed by asset title (the first of these columns present), which matches the 
+# FileName of a UMAM row
+sharestreamKeyColumns = ('Asset Title', 'asset')
+sharestreamColumn = 'SharestreamURLs'
+
+
+# Fills in the SharestreamURLs of the UMAM rows from a Sharestream asset export,
+# matching each FileName to an asset title, as the rows are read. The FileNames
+# with no link are added to missing, for reporting once the rows have been read;
+# their SharestreamURLs are left as they were.
+def joinSharestreamLinks(rows, linksFile, missing=None):
+    table, duplicates = loadJoinTable(linksFile, sharestreamKeyColumns, [sharestreamColumn])
+    say('\nLoaded {0} Sharestream links from {1}'.format(len(table), linksFile))
+    reportJoin('asset titles are listed more than once (the first link is used)', 
+               ['{0} ({1})'.format(key, n) for key, n in duplicates.items()])
+    return joinRows(rows, table, 'FileName', missing)
+
+
+# Groups the rows of the data file into objects, yielding each UMDM row together 
+# with the list of its UMAM rows as soon as the group is complete. For single-
+# rowed data, each row supplies both the UMDM and its one UMAM part.
+def groupObjects(rows, dataFileArrangement):
+    if dataFileArrangement == 'S':
+        for row in rows:
+            yield row, [dict(row)]
+    elif dataFileArrangement == 'M':
+        umdm = None
+        umams = []
+        for row in rows:
+            if row['XMLType'] == 'UMDM':
+                if umdm is not None:
+                    yield umdm, umams
+                umdm = row
+                umams = []
+            elif row['XMLType'] == 'UMAM':
+                if umdm is None:
+                    sys.exit("UMAM row found before any UMDM row.")
+                umams.append(row)
+        if umdm is not None:
+            yield umdm, umams
+    else:
+        sys.exit('Bad dataFileArrangement value!')
+
+
+# Attaches PIDs from the list to each object group in turn, the UMDM first 
+# followed by its UMAM parts.
+def assignPids(groups, pidList):
+    pids = iter(pidList)
+    for umdm, umams in groups:
+        umdm['PID'] = next(pids)
+        for umam in umams:
+            umam['PID'] = next(pids)
+        yield umdm, umams
+
+
+# Matches the !!!Anchor!!! slots used throughout the XML templates.
+anchorPattern = re.compile(r'!!!([\w/-]+)!!!')
+
+
+# Splits a template into its literal segments and anchor slots once, so that each
+# object can later be rendered with a single join. Anchors listed in the tags
+# dictionary are wrapped with their open/close tags (or dropped when empty), and
+# anchors listed in rawSlots are inserted without escaping ampersands.
+def compileTemplate(template, tags=None, rawSlots=()):
+    tags = tags or {}
+    pieces = anchorPattern.split(template)
+    literals = pieces[0::2]
+    slots = []
+    for name in pieces[1::2]:
+        openTag, closeTag = tags.get(name, (None, None))
+        slots.append((name, '!!!{0}!!!'.format(name), openTag, closeTag,
+                      name not in rawSlots))
+    return (literals, slots)
+
+
+# Renders a compiled template by filling every slot from the values dictionary
+# (keyed by bare anchor name) and joining the result in one pass. Anchors with no
+# value are left in place, as the find-and-replace approach used to do.
+def renderTemplate(compiled, values):
+    literals, slots = compiled
+    result = [literals[0]]
+    for (name, anchor, openTag, closeTag, escape), literal in zip(slots, literals[1:]):
+        v = values.get(name)
+        if v is None:
+            result.append(anchor)
+        else:
+            if escape:
+                v = v.replace('&', '&amp;')
+            if openTag is not None:
+                if v != '':
+                    result.append(openTag)
+                    result.append(v)
+                    result.append(closeTag)
+            else:
+                result.append(v)
+        result.append(literal)
+    return ''.join(result)
+
+
 # Creates a file containing the contents of the "content" string, named umd_[PID].xml,
 # with all files saved in dir 'output', and XML files in the sub-dir 'foxml'.
-def writeFile(fileStem, content, extension):
-    if extension == '.xml':
-        filePath = 'output/foxml/' + fileStem + extension
-    else:
-        filePath = 'output/' + fileStem + extension
-    f = open(filePath, mode='w')
-    # filter out blank lines and lines containing only spaces from XML
-    cleaned = os.linesep.join(
-        [line for line in content.splitlines() if line.strip()])
-    f.write(cleaned)
+# Returns the bytes written.
+def writeFile(fileStem, content, extension, outputDir='output'):
+    filePath = os.path.join(outputDir, outputPath(fileStem, extension))
+    data = cleanContent(content).encode('utf-8')
+    f = open(filePath, mode='wb')
+    f.write(data)
     f.close()
+    return data
+
+
+# Output sink writing each file separately into the output directory, as 
+# writeFile does. Every sink counts the bytes it has written, and calls done 
+# (if given) with the bytes of each file once it is written, so that the caller
+# can hash them without cleaning the content again.
+class DirectorySink:
+
+    threadSafe = True
+
+    def __init__(self, outputDir='output'):
+        self.outputDir = outputDir
+        self.bytesWritten = 0
+        self.lock = threading.Lock()
+
+    def write(self, fileStem, content, extension, done=None):
+        data = writeFile(fileStem, content, extension, self.outputDir)
+        with self.lock:
+            self.bytesWritten += len(data)
+        if done is not None:
+            done(data)
+
+    # Adds a file already on disk, such as a summary list, copying it into place
+    # unless it was written there to begin with.
+    def addFile(self, sourcePath, fileStem, extension):
+        filePath = os.path.join(self.outputDir, outputPath(fileStem, extension))
+        if not (os.path.exists(filePath) and os.path.samefile(sourcePath, filePath)):
+            shutil.copyfile(sourcePath, filePath)
+        with self.lock:
+            self.bytesWritten += os.path.getsize(filePath)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Output sink streaming every file into a single tar, tar.gz or zip archive, 
+# with the same layout as the output directory. The type of archive is taken
+# from the file name, and the compression level (0-9) is optional.
+class ArchiveSink:
+
+    threadSafe = False
+
+    def __init__(self, archivePath, compressionLevel=None):
+        self.archivePath = archivePath
+        self.bytesWritten = 0
+        self.tar = None
+        self.zip = None
+        if archivePath.endswith('.zip'):
+            if compressionLevel == 0:
+                self.zip = zipfile.ZipFile(archivePath, 'w', zipfile.ZIP_STORED)
+            else:
+                self.zip = zipfile.ZipFile(archivePath, 'w', zipfile.ZIP_DEFLATED,
+                                           compresslevel=compressionLevel)
+        elif archivePath.endswith(('.tar.gz', '.tgz')):
+            self.tar = tarfile.open(archivePath, 'w:gz', compresslevel=(
+                9 if compressionLevel is None else compressionLevel))
+        elif archivePath.endswith('.tar'):
+            self.tar = tarfile.open(archivePath, 'w')
+        else:
+            sys.exit('Unknown archive type (use .tar, .tar.gz, .tgz or .zip): {0}'.format(
+                archivePath))
+
+    def write(self, fileStem, content, extension, done=None):
+        name = outputPath(fileStem, extension).replace(os.sep, '/')
+        data = cleanContent(content).encode('utf-8')
+        if self.zip is not None:
+            self.zip.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = 0o644
+            self.tar.addfile(info, io.BytesIO(data))
+        self.bytesWritten += len(data)
+        if done is not None:
+            done(data)
+
+    # Adds a file already on disk, such as a summary list, streaming it into the
+    # archive rather than reading it into memory.
+    def addFile(self, sourcePath, fileStem, extension):
+        name = outputPath(fileStem, extension).replace(os.sep, '/')
+        if self.zip is not None:
+            self.zip.write(sourcePath, name)
+        else:
+            self.tar.add(sourcePath, name)
+        self.bytesWritten += os.path.getsize(sourcePath)
+
+    def flush(self):
+        if self.zip is not None:
+            self.zip.fp.flush()
+        else:
+            self.tar.fileobj.flush()
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        else:
+            self.tar.close()
+
+
+# Output sink handing each file to one or more background writer threads through
+# a bounded queue, so that rendering carries on while earlier files are cleaned 
+# up and written by the sink it wraps. Each thread writes whatever has queued up
+# (up to batchSize files) before flushing. Sinks that are not thread-safe get a
+# single writer thread. Flushing waits until every file queued so far has been 
+# written. Any errors are reported when the sink is closed.
+class ThreadedSink:
+
+    def __init__(self, sink, threads=1, queueSize=64, batchSize=32):
+        self.sink = sink
+        self.batchSize = batchSize
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.errors = []
+        if not sink.threadSafe:
+            threads = 1
+        self.threads = [threading.Thread(target=self.writer, daemon=True)
+                        for i in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    # Runs in each writer thread until it takes a None (the signal to stop) from 
+    # the queue, so that every thread stops on exactly one.
+    def writer(self):
+        finished = False
+        while not finished:
+            items = []
+            item = self.queue.get()
+            while True:
+                if item is None:
+                    finished = True
+                    break
+                items.append(item)
+                if len(items) >= self.batchSize:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            for fileStem, content, extension, sourcePath, done in items:
+                try:
+                    if sourcePath is None:
+                        self.sink.write(fileStem, content, extension, done)
+                    else:
+                        self.sink.addFile(sourcePath, fileStem, extension)
+                except Exception as e:
+                    self.errors.append((outputPath(fileStem, extension), e))
+            try:
+                self.sink.flush()
+            except Exception as e:
+                self.errors.append(('(flush)', e))
+            for i in range(len(items) + finished):
+                self.queue.task_done()
+
+    def write(self, fileStem, content, extension, done=None):
+        if self.errors:
+            self.close()
+        self.queue.put((fileStem, content, extension, None, done))
+
+    def addFile(self, sourcePath, fileStem, extension):
+        if self.errors:
+            self.close()
+        self.queue.put((fileStem, None, extension, sourcePath, None))
+
+    def flush(self):
+        if self.threads:
+            self.queue.join()
+
+    @property
+    def bytesWritten(self):
+        return self.sink.bytesWritten
+
+    def close(self):
+        if self.threads:
+            for thread in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+            self.sink.close()
+        if self.errors:
+            for path, e in self.errors:
+                print('Error! Could not write {0}: {1}'.format(path, e))
+            sys.exit('{0} output files could not be written.'.format(len(self.errors)))
+
+
+# Opens the output sink for a batch: the output directory, or an archive if one
+# was requested, written by background threads unless writerThreads is 0.
+def openSink(outputDir='output', archive=None, compressionLevel=None, writerThreads=1):
+    if archive:
+        say('\nWriting output files to the archive {0}'.format(archive))
+        sink = ArchiveSink(archive, compressionLevel)
+    else:
+        sink = DirectorySink(outputDir)
+    if writerThreads > 0:
+        sink = ThreadedSink(sink, writerThreads)
+    return sink
+
+
+# Writes the summary lists of a batch into the output directory as each object 
+# group is finished, rather than collecting them until the end, so that memory 
+# use does not grow with the batch and an interrupted run leaves the lists of 
+# the groups it completed (up to the last flush, made every few seconds by 
+# runBatch along with the manifest's). pids.txt lists every PID, UMDMpids.txt the UMDM PIDs,
+# and links.txt and links.csv (the same with a header) each object's Identifier,
+# type and PID, with a link for the UMDM. With listChanged, changed.txt lists 
+# the objects that are new or have changed since a previous run.
+class SummaryWriter:
+
+    columns = ['Identifier', 'XMLType', 'PID', 'URL']
+    linkUrl = 'http://digital.lib.umd.edu/video?pid={0}'
+
+    def __init__(self, outputDir='output', listChanged=False):
+        self.outputDir = outputDir
+        self.files = {}
+        self.pids = self.open('pids', '.txt')
+        self.umdmPids = self.open('UMDMpids', '.txt')
+        self.links = csv.writer(self.open('links', '.txt'), quoting=csv.QUOTE_ALL,
+                                lineterminator='\n')
+        self.linksCsv = csv.writer(self.open('links', '.csv'), lineterminator='\n')
+        self.linksCsv.writerow(self.columns)
+        self.changed = self.open('changed', '.txt') if listChanged else None
+        self.objects = 0
+        self.changedObjects = 0
+
+    def open(self, fileStem, extension):
+        f = open(os.path.join(self.outputDir, outputPath(fileStem, extension)), 'w',
+                 encoding='utf-8')
+        self.files[(fileStem, extension)] = f
+        return f
+
+    # Lists the objects of a group: the PIDs of its UMAM parts and then its UMDM,
+    # and the links of its UMDM and then its parts.
+    def addGroup(self, umdm, umams):
+        for x in umams:
+            self.pids.write(x['PID'] + '\n')
+        self.pids.write(umdm['PID'] + '\n')
+        self.umdmPids.write(umdm['PID'] + '\n')
+        umdmRow = [umdm['Identifier'], 'UMDM', umdm['PID'], self.linkUrl.format(umdm['PID'])]
+        self.links.writerow(umdmRow)
+        self.linksCsv.writerow(umdmRow)
+        for x in umams:
+            self.links.writerow([x['Identifier'], 'UMAM', x['PID']])
+            self.linksCsv.writerow([x['Identifier'], 'UMAM', x['PID'], ''])
+        self.objects += len(umams) + 1
+
+    def addChanged(self, pids):
+        for pid in pids:
+            self.changed.write(pid + '\n')
+            self.changedObjects += 1
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    # Closes the lists and returns their paths, with the stem and extension of 
+    # each, so that they can be added to the output sink.
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        return [(f.name, fileStem, extension) 
+                for (fileStem, extension), f in self.files.items()]
+
+
+# The attribute holding the timestamp written into every datastream of an object
+timestampAttribute = 'CREATED="'
+
+
+# Returns the SHA-256 hash of a file already on disk.
+def fileHash(filePath):
+    with open(filePath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Returns the SHA-256 hash of a rendered object with its timestamps normalized,
+# so that objects rendered from the same data by different runs match. The 
+# content is hashed as rendered, before the blank lines are cleaned out when it
+# is written. Every datastream of an object is stamped with the same time, so
+# the first CREATED attribute gives the timestamp to replace throughout.
+def objectDigest(content):
+    start = content.find(timestampAttribute)
+    if start != -1:
+        start += len(timestampAttribute)
+        content = content.replace(content[start:content.index('"', start)], 'TIMESTAMP')
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+# Returns the settings of a batch as the answers to the job prompts, so that a
+# resumed run can set up the same batch without asking again.
+def batchAnswers(batch):
+    rights = [letter for letter, scheme in rightsSchemes.items() 
+              if scheme == batch['rightsScheme']]
+    return {
+            'rights' :          rights[0],
+            'mediaType' :       batch['mediaType'][0].upper(),
+            'collection' :      batch['collectionPID'],
+            'timeFormat' :      'M' if batch['timeUnits'] == 'minutes' else 'I'
+            }
+
+
+# Starts the checkpoint manifest for a run, recording the run's settings and any
+# groups already completed by an earlier run, and returns it open for appending.
+def startManifest(run, completed=(), outputDir='output'):
+    manifestPath = os.path.join(outputDir, manifestFile)
+    with open(manifestPath + '.tmp', 'w') as f:
+        for record in [run] + list(completed):
+            f.write(json.dumps(record) + '\n')
+    os.replace(manifestPath + '.tmp', manifestPath)
+    return open(manifestPath, 'a')
+
+
+# An object group whose files have been handed to the sink. As the sink writes
+# each file (in a writer thread, for a threaded sink) the SHA-256 hash of its
+# bytes is kept, along with the bytes themselves if the group is to be ingested,
+# so that the group can be recorded in the manifest once all its files are on
+# disk without the content being cleaned and hashed again on the main thread.
+class WrittenGroup:
+
+    def __init__(self, number, documents, digests, written=None, keepData=False):
+        self.number = number
+        self.pids = [pid for pid, content in documents]
+        self.digests = digests
+        self.keepData = keepData
+        self.hashes = {}
+        self.data = {}
+        self.remaining = len(documents) if written is None else len(written)
+        self.lock = threading.Lock()
+
+    # Called by the sink with the bytes of an object's file once it is written.
+    def fileWritten(self, pid, data):
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self.hashes[pid] = digest
+            if self.keepData:
+                self.data[pid] = data
+            self.remaining -= 1
+
+
+# Records a completed object group in the manifest, which runBatch flushes to 
+# disk every few seconds so that it survives the run being interrupted. Only 
+# the files of the objects written are listed (all of them unless only changed
+# objects are being written), but the digests of every object are kept for the
+# next run to compare against.
+def recordGroup(manifest, group):
+    files = {outputPath(pid.replace(':', '_').strip(), '.xml'): group.hashes[pid]
+             for pid in group.pids if pid in group.hashes}
+    manifest.write(json.dumps({'group': group.number, 'pids': group.pids,
+                               'files': files, 'digests': group.digests}) + '\n')
+
+
+# Takes the groups at the head of the queue whose files have all been written,
+# in order, recording each in the manifest and queueing the objects written for
+# ingest into Fedora, parts before the UMDM.
+def finishGroups(pending, manifest, ingester, metrics):
+    while pending and pending[0].remaining == 0:
+        group = pending.popleft()
+        if manifest is not None:
+            with metrics.stage('manifest'):
+                recordGroup(manifest, group)
+        if ingester is not None and group.data:
+            with metrics.stage('ingest'):
+                ingester.submit([(pid, group.data[pid]) for pid in group.pids 
+                                 if pid in group.data], group.pids[-1])
+
+
+# Reads the manifest left by an earlier run, returning the run's settings and
+# the records of the groups whose files were all written out intact. Checking 
+# stops at the first group with a missing or damaged file, as that group and 
+# any after it are generated again.
+def loadManifest(outputDir='output'):
+    manifestPath = os.path.join(outputDir, manifestFile)
+    if not os.path.isfile(manifestPath):
+        sys.exit('No manifest to resume from: {0}'.format(manifestPath))
+    run, records = readManifest(manifestPath)
+    completed = []
+    for record in records:
+        if not all(os.path.isfile(os.path.join(outputDir, path)) and 
+                   fileHash(os.path.join(outputDir, path)) == digest
+                   for path, digest in record['files'].items()):
+            break
+        completed.append(record)
+    return run, completed
+
+
+# Reads the manifest of a previous run to compare a new run against, given the
+# manifest itself or the output directory holding it. Returns the previous run's
+# settings and the digests of all of its objects, keyed by PID.
+def loadDigests(previous):
+    manifestPath = previous
+    if os.path.isdir(previous):
+        manifestPath = os.path.join(previous, manifestFile)
+    if not os.path.isfile(manifestPath):
+        sys.exit('No manifest to compare against: {0}'.format(manifestPath))
+    run, records = readManifest(manifestPath)
+    digests = {}
+    for record in records:
+        if 'digests' not in record:
+            sys.exit('{0} has no object digests to compare against; it was written '
+                     'by an older version of the generator.'.format(manifestPath))
+        digests.update(record['digests'])
+    return run, digests
+
+
+# Formats milliseconds as decimal minutes, rounded to two decimal places.
+def formatMinutes(milliseconds):
+    return str(round(milliseconds / 60000, 2))
+
+
+# Formats a runtime in milliseconds in the time units chosen for the batch.
+def formatRunTime(milliseconds, timeUnits):
+    if timeUnits == 'minutes':
+        return formatMinutes(milliseconds)
+    else:
+        return formatDuration(milliseconds)
 
 
-# Select time format for runtime conversions (either minutes as decimal or ISO)
-def timeFormatSelection():
-    choice = input('Enter the output time format ([I] for ISO, or [M] for minutes): ')
+# Select time format for runtime conversions (either minutes as decimal or ISO),
+# returning the time units used for the summed runtime of each object.
+def timeFormatSelection(answer=None):
+    choice = ask('Enter the output time format ([I] for ISO, or [M] for minutes): ', answer)
     while choice not in ['I', 'i', 'M', 'm']:
         choice = input('You must enter either H or M!')
     if choice == "M" or choice == "m":
-        # When passed a string in the format 'HH:MM:SS', returns the decimal value in minutes,
-        # rounded to two decimal places.
         timeUnits = "minutes"
-        nullTimeCounter = 0
-        def convertTime(inputTime):
-            hrsMinSec = inputTime.split(':')    # otherwise, split the string at the colon
-            minutes = int(hrsMinSec[0]) * 60    # multiply the first value by 60
-            minutes += int(hrsMinSec[1])        # add the second value
-            minutes += int(hrsMinSec[2]) / 60   # add the third value divided by 60
-            return round(minutes, 2)  # return the resulting decimal rounded to two places
     elif choice == "I" or choice == "i":
-        # Convert the input time to a timedelta and return it
         timeUnits = "hh:mm:ss"
-        nullTimeCounter = datetime.timedelta(0)
-        def convertTime(inputTime):
-            hh, mm, ss = map(int, inputTime.split(":"))
-            result = datetime.timedelta(hours=hh, minutes=mm, seconds=ss)
-            return result
-    else:
-        print("Something went wrong with the time format selection!")
-        exit
-    return nullTimeCounter, convertTime, timeUnits
+    return timeUnits
 
 
-def generateTechnicalMetaString(data, mediaType, convertTime):
+# Builds the technical metadata block for a part with lxml, given its duration 
+# already formatted.
+def buildTechnicalMeta(data, mediaType, duration):
     # create root element and tree object
     root = etree.Element('technical')
     tech_meta = etree.ElementTree(root)
@@ -452,8 +1021,7 @@ def generateTechnicalMetaString(data, mediaType, convertTime):
     format = etree.SubElement(root, 'format')
     # create media {audio,video} and duration subelement
     media = etree.SubElement(root, mediaType)
-    etree.SubElement(media, 'duration').text = isodate.strftime(
-        convertTime(data['DurationDerivatives']), "%H:%M:%S")
+    etree.SubElement(media, 'duration').text = duration
     if mediaType == 'audio':
         etree.SubElement(format, 'mimeType').text = "audio/mpeg"
         etree.SubElement(format, 'compression').text = "lossy"
@@ -498,43 +1066,114 @@ def generateTechnicalMetaString(data, mediaType, convertTime):
     return etree.tostring(tech_meta, pretty_print=True)
 
 
-# Performs series of find and replace operations to generate UMAM file from the template.
+# The columns describing a part's media profile: everything in the technical 
+# metadata block except the file name and duration, which differ for every part.
+technicalFields = ('TrackFormat', 'Color', 'DataRate', 'FrameRate', 'ScanSignal', 
+                   'VideoStandard', 'AspectRatio', 'HorizontalPixels', 'VerticalPixels', 
+                   'Mono/Stereo', 'Language')
+
+
+# Marks the file name and duration slots in a technical metadata block. It is
+# made afresh for each run, so that no value in the data can pass for a slot.
+slotSentinel = uuid.uuid4().hex
+
+
+# Builds and compiles the technical metadata block for a media profile (a tuple
+# of the technical fields present and their values), leaving slots for the file
+# name and duration. The block is split at the sentinels rather than parsed for
+# anchors, as the profile values may contain anything. The most recently used
+# profiles are kept, so a batch with a handful of profiles builds each block
+# only once.
+@functools.lru_cache(maxsize=256)
+def technicalMetaTemplate(mediaType, profile):
+    data = dict(profile)
+    data['FileName'] = slotSentinel + 'FileName'
+    block = buildTechnicalMeta(data, mediaType, slotSentinel + 'Duration').decode('utf-8')
+    pieces = re.split(slotSentinel + '(FileName|Duration)', block)
+    slots = [(name, '!!!{0}!!!'.format(name), None, None, False) for name in pieces[1::2]]
+    return (pieces[0::2], slots)
+
+
+# Escapes text for XML element content as lxml does.
+def xmlText(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;').replace('\r', '&#13;')
+
+
+# Returns the technical metadata block for a part, filling in only the file name
+# and duration of the block cached for its media profile.
+def renderTechnicalMeta(data, mediaType):
+    profile = tuple((field, data[field]) for field in technicalFields if field in data)
+    return renderTemplate(technicalMetaTemplate(mediaType, profile), {
+            'FileName' :    xmlText(data['FileName']),
+            'Duration' :    formatDuration(parseDuration(data['DurationDerivatives']))
+            })
+
+
+# Fills the compiled UMAM template with the data for a single part.
 def createUMAM(data, batch, pid):
     timeStamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
     # create technical metadata section
-    techMeta = generateTechnicalMetaString(data, batch['mediaType'], 
-        batch['convertTime']).decode('utf-8')
+    techMeta = renderTechnicalMeta(data, batch['mediaType'])
     
-    # initialize the output starting with the specified template file
-    outputfile = batch['umam']
     # create mapping of the metadata onto the UMAM XML template file
     umamMap = {
-                '!!!PID!!!' :                   pid,
-                '!!!ContentModel!!!' :          'UMD_VIDEO',
-                '!!!Status!!!' :                batch['rightsScheme']['amInfoStatus'],
-                '!!!FileName!!!' :              data['FileName'],
-                '!!!DateDigitized!!!' :         data['DateDigitized'],
-                '!!!DigitizedByDept!!!' :       data['DigitizedByDept'],
-                '!!!ExtRefDescription!!!' :     'Sharestream',
-                '!!!SharestreamURL!!!' :        data['SharestreamURLs'],
-                '!!!DigitizedByPers!!!' :       data['DigitizedByPers'],
-                '!!!DigitizationNotes!!!' :     data['DigitizationNotes'],
-                '!!!AccessRights!!!' :          batch['rightsScheme']['adminRightsAccess'],
-                '!!!TimeStamp!!!' :             timeStamp,
-                '!!!TechMeta!!!' :              techMeta
+                'PID' :                   pid,
+                'ContentModel' :          'UMD_VIDEO',
+                'Status' :                batch['rightsScheme']['amInfoStatus'],
+                'FileName' :              data['FileName'],
+                'DateDigitized' :         data['DateDigitized'],
+                'DigitizedByDept' :       data['DigitizedByDept'],
+                'ExtRefDescription' :     'Sharestream',
+                'SharestreamURL' :        data['SharestreamURLs'],
+                'DigitizedByPers' :       data['DigitizedByPers'],
+                'DigitizationNotes' :     data['DigitizationNotes'],
+                'AccessRights' :          batch['rightsScheme']['adminRightsAccess'],
+                'TimeStamp' :             timeStamp,
+                'TechMeta' :              techMeta
     }
-    # Carry out a find and replace for each line of the data mapping
-    # and convert ampersands in data into XML entities in the process
-    for k, v in umamMap.items():
-        outputfile = outputfile.replace(k, v.replace('&', '&amp;'))
-    return outputfile
+    # Render the template in one pass, converting ampersands in data into 
+    # XML entities in the process
+    return renderTemplate(batch['umam'], umamMap)
+
+
+# XML tags with which to wrap the CSV data in the UMDM template, keyed by anchor
+# name. Anchors whose data is empty are removed from the output altogether.
+def umdmTags(timeUnits):
+    return {
+            'ContentModel' :          ('<type>', '</type>'),
+            'Status' :                ('<status>', '</status>'),
+            'Title' :                 ('<title type="main">', '</title>'),
+            'AlternateTitle' :        ('<title type="alternate">', '</title>'),
+            'Identifier' :            ('<identifier>', '</identifier>'),
+            'Description/Summary' :   ('<description type="summary">', '</description>'),
+            'Rights' :                ('<rights type="access">', '</rights>'),
+            'CopyrightHolder' :       ('<rights type="copyrightowner">', '</rights>'),
+            'Continent' :             ('<geogName type="continent">', '</geogName>'),
+            'Country' :               ('<geogName type="country">', '</geogName>'),
+            'Region/State' :          ('<geogName type="region">', '</geogName>'),
+            'Settlement/City' :       ('<geogName type="settlement">', '</geogName>'),
+            'Repository' :            ('<repository><corpName>', '</corpName></repository>'),
+            'Dimensions' :            ('<size units="in">', '</size>'),
+            'DurationMasters' :       ('<extent units="{0}">'.format(timeUnits), '</extent>'),
+            'Format' :                ('<format>', '</format>'),
+            'ArchivalLocation' :      ('<bibRef>', '</bibRef>'),
+            'Language' :              ('<language>', '</language>')
+            }
+
 
+# Compiles the UMDM template once the time units are known, reusing the result
+# for any later batch with the same template and units.
+@functools.lru_cache(maxsize=None)
+def compileUMDM(template, timeUnits):
+    return compileTemplate(template, umdmTags(timeUnits), 
+                           rawSlots=('INSERT_METS_HERE',))
 
-# Performs series of find and replace operations to generate UMDM file from the template.
+
+# Fills the compiled UMDM template with the data for an object group, given the
+# summed runtime of its parts in milliseconds.
 def createUMDM(data, batch, summedRunTime, mets):
     timeStamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-    # Initialize the output starting with the specified template file
-    outputfile = batch['umdm']
     # Strip out trailing quotation marks from Dimensions field
     if data['Dimensions'].endswith('"'):
         data['Dimensions'] = data['Dimensions'][0:-1]
@@ -572,365 +1211,852 @@ def createUMDM(data, batch, summedRunTime, mets):
                                                 item=data['Item'],
                                                 accession=data['Accession'] 
                                                 )
-    # Insert the RELS-METS section compiled from the UMAM files
-    outputfile = outputfile.replace('!!!INSERT_METS_HERE!!!', mets)     # Insert the METS
-    outputfile = stripAnchors(outputfile)                               # Strip out anchor points
-    # XML tags with which to wrap the CSV data
-    XMLtags = {
-            '!!!ContentModel!!!' :     {    'open' : '<type>',
-                                            'close' : '</type>'    },
-            '!!!Status!!!' : {              'open' : '<status>',
-                                            'close' : '</status>' },
-            '!!!Title!!!' : {               'open' : '<title type="main">',
-                                            'close' : '</title>' },
-            '!!!AlternateTitle!!!' : {      'open' : '<title type="alternate">',
-                                            'close' : '</title>'},
-            '!!!Identifier!!!' : {          'open' : '<identifier>',
-                                            'close' : '</identifier>'},
-            '!!!Description/Summary!!!' : { 'open' : '<description type="summary">',
-                                            'close' : '</description>'},
-            '!!!Rights!!!' : {              'open' : '<rights type="access">',
-                                            'close' : '</rights>'},
-            '!!!CopyrightHolder!!!' : {     'open' : '<rights type="copyrightowner">',
-                                            'close' : '</rights>'},
-            '!!!Continent!!!' : {           'open' : '<geogName type="continent">',
-                                            'close' : '</geogName>'},
-            '!!!Country!!!' : {             'open' : '<geogName type="country">',
-                                            'close' : '</geogName>'},
-            '!!!Region/State!!!' : {        'open' : '<geogName type="region">',
-                                            'close' : '</geogName>'},
-            '!!!Settlement/City!!!' : {     'open' : '<geogName type="settlement">',
-                                            'close' : '</geogName>'},
-            '!!!Repository!!!' : {          'open' : '<repository><corpName>',
-                                            'close' : '</corpName></repository>'},
-            '!!!Dimensions!!!' : {          'open' : '<size units="in">',
-                                            'close' : '</size>'},
-            '!!!DurationMasters!!!' : {     'open' : '<extent units="{0}">'.format(
-                                                        batch['timeUnits']),
-                                            'close' : '</extent>'},
-            '!!!Format!!!' : {              'open' : '<format>',
-                                            'close' : '</format>'},
-            '!!!ArchivalLocation!!!' : {    'open' : '<bibRef>',
-                                            'close' : '</bibRef>'},
-            '!!!Language!!!' : {            'open' : '<language>',
-                                            'close' : '</language>'}
-            }
+    # Finish the RELS-METS section compiled from the UMAM files
+    metsString = finishMets(mets, timeStamp, batch['collectionPID'])
 
     # Create mapping of the metadata onto the UMDM XML template file
     umdmMap = {
-                '!!!PID!!!' :                   data['PID'],
-                '!!!ContentModel!!!' :          'UMD_VIDEO',
-                '!!!Status!!!' :                batch['rightsScheme']['doInfoStatus'],
-                '!!!Title!!!' :                 data['Title'],
-                '!!!AlternateTitle!!!' :        data['AlternateTitle'],
-                '!!!Agents!!!' :                agentsString,
-                '!!!Identifier!!!' :            data['Identifier'],
-                '!!!Description/Summary!!!' :   data['Description/Summary'],
-                '!!!Rights!!!' :                data['Rights'],
-                '!!!CopyrightHolder!!!' :       data['CopyrightHolder'],
-                '!!!MediaType/Form!!!' :        mediaTypeString,
-                '!!!Continent!!!' :             data['Continent'],
-                '!!!Country!!!' :               data['Country'],
-                '!!!Region/State!!!' :          data['Region/State'],
-                '!!!Settlement/City!!!' :       data['Settlement/City'],
-                '!!!InsertDateHere!!!' :        dateTagString,
-                '!!!Language!!!' :              data['Language'],
-                '!!!Dimensions!!!' :            data['Dimensions'],
-                '!!!DurationMasters!!!' :       isodate.strftime(summedRunTime,
-                                                    "%H:%M:%S"),
-                '!!!Format!!!' :                data['Format'],
-                '!!!RepositoryBrowse!!!' :      browseTermsString,
-                '!!!Repository!!!' :            data['Department'],
-                '!!!TopicalSubjects!!!' :       topicalSubjects,
-                '!!!ArchivalLocation!!!' :      archivalLocation,
-                '!!!CollectionPID!!!' :         batch['collectionPID'],
-                '!!!TimeStamp!!!' :             timeStamp,
-                '!!!TopicalSubjects!!!' :       topicalSubjects
+                'PID' :                   data['PID'],
+                'ContentModel' :          'UMD_VIDEO',
+                'Status' :                batch['rightsScheme']['doInfoStatus'],
+                'Title' :                 data['Title'],
+                'AlternateTitle' :        data['AlternateTitle'],
+                'Agents' :                agentsString,
+                'Identifier' :            data['Identifier'],
+                'Description/Summary' :   data['Description/Summary'],
+                'Rights' :                data['Rights'],
+                'CopyrightHolder' :       data['CopyrightHolder'],
+                'MediaType/Form' :        mediaTypeString,
+                'Continent' :             data['Continent'],
+                'Country' :               data['Country'],
+                'Region/State' :          data['Region/State'],
+                'Settlement/City' :       data['Settlement/City'],
+                'InsertDateHere' :        dateTagString,
+                'Language' :              data['Language'],
+                'Dimensions' :            data['Dimensions'],
+                'DurationMasters' :       formatRunTime(summedRunTime, 
+                                                        batch['timeUnits']),
+                'Format' :                data['Format'],
+                'RepositoryBrowse' :      browseTermsString,
+                'Repository' :            data['Department'],
+                'TopicalSubjects' :       topicalSubjects,
+                'ArchivalLocation' :      archivalLocation,
+                'INSERT_METS_HERE' :      metsString,
+                'TimeStamp' :             timeStamp
     }
 
-    # Carry out a find and replace for each line of the data mapping
-    # and convert ampersands to XML entities in the process
-    for k, v in umdmMap.items():
-        if k in XMLtags.keys(): # If there is an XML tag available
-            if v != '':         # and if the data point is not empty
-                # wrap the data point with the XML tag and insert it in the template
-                myTag = XMLtags[k]['open'] + v.replace('&', '&amp;') + XMLtags[k]['close']
-                outputfile = outputfile.replace(k, myTag)
-            else: # if the data is empty, get rid of the anchor point
-                outputfile = outputfile.replace(k, '')
-        else: # but if there is no xml tag available, simply replace anchor with value
-            outputfile = outputfile.replace(k, v.replace('&', '&amp;'))
-    return outputfile
-
-
-# Initiates a new METS snippet for use in a UMDM file
+    # Render the template in one pass, wrapping data in its XML tags and 
+    # converting ampersands to XML entities in the process
+    return renderTemplate(batch['umdm'], umdmMap)
+
+
+# Loads and compiles the METS template and its per-part fragments. The files are
+# read from disk only once per process, however many objects and parts follow.
+@functools.lru_cache(maxsize=None)
+def loadMetsTemplates():
+    templates = {}
+    for key, fileName in [('mets', 'mets'), ('A', 'metsA'), 
+                          ('B', 'metsB'), ('C', 'metsC')]:
+        with open('templates/{0}.xml'.format(fileName), 'r') as f:
+            templates[key] = compileTemplate(f.read())
+    return templates
+
+
+# Initiates a new METS record for use in a UMDM file, holding the lists of 
+# file, fptr and div entries to be filled in by the UMAM parts.
 def createMets():
-    metsFile = open('templates/mets.xml', 'r').read()
-    return(metsFile)
+    return {'Anchor-A': [], 'Anchor-B': [], 'Anchor-C': []}
 
 
 # Updates a METS record with UMAM info
 def updateMets(partNumber, mets, fileName, pid):
-    id = str(partNumber + 1)   # first item(s) are collection PIDs
-    metsSnipA = open('templates/metsA.xml', 'r').read() + '!!!Anchor-A!!!'
-    metsSnipB = open('templates/metsB.xml', 'r').read() + '!!!Anchor-B!!!'
-    metsSnipC = open('templates/metsC.xml', 'r').read() + '!!!Anchor-C!!!'
-    mets = mets.replace('!!!Anchor-A!!!', metsSnipA)
-    mets = mets.replace('!!!Anchor-B!!!', metsSnipB)
-    mets = mets.replace('!!!Anchor-C!!!', metsSnipC)
-    mets = mets.replace('!!!FileName!!!', fileName)
-    mets = mets.replace('!!!ID!!!', id)
-    mets = mets.replace('!!!PID!!!', pid)
-    mets = mets.replace('!!!Order!!!', str(partNumber))
+    templates = loadMetsTemplates()
+    values = {
+                'ID' :      str(partNumber + 1),    # first item(s) are collection PIDs
+                'PID' :     pid,
+                'Order' :   str(partNumber)
+                }
+    mets['Anchor-A'].append(renderTemplate(templates['A'], values))
+    mets['Anchor-B'].append(renderTemplate(templates['B'], values))
+    mets['Anchor-C'].append(renderTemplate(templates['C'], values))
     return mets
 
 
-# Strips out the anchor points used in creating the METS 
-def stripAnchors(target):
-    f = re.sub(r"\n\s*!!!Anchor-[ABC]!!!", "", target)
-    return f
+# Outputs the finished rels-mets block from the entries collected for each part.
+def finishMets(mets, timeStamp, collectionPID):
+    values = {anchor: ''.join(entries) for anchor, entries in mets.items()}
+    values['TimeStamp'] = timeStamp
+    values['CollectionPID'] = collectionPID
+    return renderTemplate(loadMetsTemplates()['mets'], values)
+
+
+# Renders all of the FOXML documents for one object group: the UMAM for each part,
+# followed by the UMDM with its METS record and summed runtime. Returns the list of
+# (PID, document) pairs in write order, the converted runtime of each part, and
+# the summed runtime, formatted in the batch's time units. Runtimes are summed
+# as whole milliseconds.
+def renderGroup(umdm, umams, batch):
+    mets = createMets()
+    summedRunTime = 0
+    documents = []
+    runTimes = []
+    for partNumber, x in enumerate(umams, 1):
+        documents.append((x['PID'], createUMAM(x, batch, x['PID'])))
+        runTime = parseDuration(x['DurationDerivatives'])
+        runTimes.append(formatRunTime(runTime, batch['timeUnits']))
+        summedRunTime += runTime
+        updateMets(partNumber, mets, x['FileName'], x['PID'])
+    documents.append((umdm['PID'], createUMDM(umdm, batch, summedRunTime, mets)))
+    return documents, runTimes, formatRunTime(summedRunTime, batch['timeUnits'])
+
+
+# Batch settings for a rendering worker process, set once when the worker starts
+# rather than sent along with every group.
+workerBatch = None
+
+
+def initWorker(batch):
+    global workerBatch
+    workerBatch = batch
+
+
+def renderWorkerGroup(group):
+    return renderGroup(group[0], group[1], workerBatch)
+
+
+# Renders the object groups, yielding each group along with its rendered results
+# in the same order as the groups arrive. With more than one worker, groups are
+# rendered in a process pool, keeping a bounded number in flight so that memory
+# still depends on the size of the objects rather than the batch. The first 
+# skip groups, completed by an earlier run, are passed through unrendered.
+def renderGroups(groups, batch, workers=1, skip=0):
+    groups = iter(groups)
+    for number, group in enumerate(groups):
+        if number >= skip:
+            groups = itertools.chain([group], groups)
+            break
+        yield group + (None, None, None)
+    if workers <= 1:
+        for umdm, umams in groups:
+            yield (umdm, umams) + renderGroup(umdm, umams, batch)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, 
+            initializer=initWorker, initargs=(batch,)) as executor:
+        pending = collections.deque()
+        for group in groups:
+            pending.append((group, executor.submit(renderWorkerGroup, group)))
+            if len(pending) >= workers * 4:
+                group, future = pending.popleft()
+                yield group + future.result()
+        while pending:
+            group, future = pending.popleft()
+            yield group + future.result()
+
+
+# Answers that a job may supply in place of the interactive prompts, with the 
+# choices accepted for each (None where any value is accepted).
+jobOptions = {
+    'name' :            None,
+    'dataFile' :        None,
+    'arrangement' :     ('S', 'M'),
+    'pidFile' :         None,
+    'pidServer' :       ('S', 'P'),
+    'pidServerUrl' :    None,
+    'pidChunkSize' :    None,
+    'username' :        None,
+    'password' :        None,
+    'rights' :          ('P', 'R', 'C', 'M'),
+    'mediaType' :       ('A', 'V'),
+    'collection' :      ('D', 'A', 'F'),
+    'timeFormat' :      ('I', 'M'),
+    'workers' :         None,
+    'archive' :         None,
+    'compressionLevel' : None,
+    'writerThreads' :   None,
+    'handles' :         None,
+    'handleWorkers' :   None,
+    'handleUrl' :       None,
+    'handleCache' :     None,
+    'resume' :          None,
+    'verify' :          None,
+    'schemas' :         None,
+    'quiet' :           None,
+    'verbose' :         None,
+    'profile' :         None,
+    'stats' :           None,
+    'diff' :            None,
+    'ingest' :          ('S', 'P'),
+    'ingestUrl' :       None,
+    'ingestWorkers' :   None,
+    'sharestreamLinks' : None
+    }
 
 
-def main():
-    
-    mets = ""           # empty string for compiling METS record
-    objectGroups = 0    # counter for UMDM plus UMAM(s) as a group
-    objectParts = 0     # counter for the number of UMAM parts for each UMDM
-    pidCounter = 0      # counter for coordinating PID list with data lines from CSV
-    filesWritten = 0    # counter for file outputs
-    umdmList = []       # list for compiling list of UMDM pids
-    outputFiles = []    # list for compiling list of all pids written
-    summaryList = []    # list for compiling list of PIDs and Object IDs
-    batch = {}          # dictionary for batch-related metadata
-    
-    # Create a timeStamp for these operations
-    timeStamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-    
-    # Initiate the program, recording the timestamp and name of user
-    greeting()
-    
-    # Check for existence of output directories and create if necessary
-    setup_output_dirs()
-    
-    # Load CSV data
-    dataFile, fileName = loadFile('data')
-    
-    # Load the lines of the data file into a csv.DictReader object
-    myData = [row for row in csv.DictReader(dataFile)]
-    print('Data successfully read.')
+# The job settings that are whole numbers, with the smallest value accepted
+numberOptions = {
+    'pidChunkSize' :    1,
+    'workers' :         1,
+    'compressionLevel' : 0,
+    'writerThreads' :   0,
+    'handleWorkers' :   1,
+    'ingestWorkers' :   1
+    }
+
+
+# Changed objects keep the PIDs of the run they are compared with, so they 
+# already exist in Fedora and cannot be ingested as new objects
+diffIngestError = ('A run comparing with an earlier run (diff) cannot ingest: its changed '
+                   'objects keep PIDs that are already in Fedora.')
+
+
+# Reads the command-line options for the run.
+def parseArgs():
+    parser = argparse.ArgumentParser(
+        description='Generate FOXML files for Digital Collections audio and video. '
+                    'Any answer not supplied by a job file or option is prompted for.')
+    parser.add_argument('--job', metavar='FILE',
+        help='TOML or JSON job file supplying answers to the prompts')
+    parser.add_argument('--name', help='name of the person running the batch')
+    parser.add_argument('--data-file', dest='dataFile', metavar='FILE',
+        help='CSV data file')
+    parser.add_argument('--arrangement', choices=jobOptions['arrangement'],
+        help='single (S) or multiple (M) rows for each object')
+    parser.add_argument('--pid-file', dest='pidFile', metavar='FILE',
+        help='load PIDs from a previously saved XML file')
+    parser.add_argument('--pid-server', dest='pidServer', choices=jobOptions['pidServer'],
+        help='request PIDs from fedoraStage (S) or Production (P)')
+    parser.add_argument('--pid-server-url', dest='pidServerUrl', metavar='URL',
+        help='request PIDs from this getNextPID URL instead (e.g. a test server)')
+    parser.add_argument('--pid-chunk-size', dest='pidChunkSize', type=int, metavar='N',
+        help='number of PIDs to request at a time (default: 1000)')
+    parser.add_argument('--username', help='server username')
+    parser.add_argument('--password', help='server password')
+    parser.add_argument('--rights', choices=jobOptions['rights'],
+        help='rights scheme: Public, Restricted, Campus only, or Mediated')
+    parser.add_argument('--media-type', dest='mediaType', choices=jobOptions['mediaType'],
+        help='batch of audio (A) or video (V)')
+    parser.add_argument('--collection', 
+        help='collection: D, A, F, or a collection PID such as umd:3392')
+    parser.add_argument('--time-format', dest='timeFormat', choices=jobOptions['timeFormat'],
+        help='output runtimes in ISO (I) or minutes (M)')
+    parser.add_argument('--workers', type=int, metavar='N',
+        help='number of processes to use for rendering (default: 1)')
+    parser.add_argument('--archive', metavar='FILE',
+        help='write the output files into a single .tar, .tar.gz, .tgz or .zip archive')
+    parser.add_argument('--compression-level', dest='compressionLevel', type=int,
+        choices=range(10), metavar='0-9', help='compression level for the archive')
+    parser.add_argument('--writer-threads', dest='writerThreads', type=int, metavar='N',
+        help='number of background threads writing output files, or 0 to write '
+             'them in turn with rendering (default: 1)')
+    parser.add_argument('--handles', action='store_true', default=None,
+        help='look up the handles of the UMDM objects and write output/handled.csv')
+    parser.add_argument('--handle-workers', dest='handleWorkers', type=int, metavar='N',
+        help='number of handle lookups to run at once (default: 8)')
+    parser.add_argument('--handle-url', dest='handleUrl', metavar='URL',
+        help='handle lookup endpoint (e.g. a test server)')
+    parser.add_argument('--handle-cache', dest='handleCache', metavar='FILE',
+        help='local cache of handles already fetched (default: handles.db)')
+    parser.add_argument('--resume', action='store_true', default=None,
+        help='resume an interrupted run in the output directory, skipping the '
+             'object groups already completed')
+    parser.add_argument('--verify', action='store_true', default=None,
+        help='check that the FOXML files written are well-formed, as verify.py does')
+    parser.add_argument('--schemas', metavar='DIR',
+        help='with --verify, also validate datastreams against the schemas in DIR')
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument('--quiet', action='store_true', default=None,
+        help='show only prompts and errors')
+    verbosity.add_argument('--verbose', action='store_true', default=None,
+        help='show every file written and the templates used')
+    parser.add_argument('--profile', metavar='FILE',
+        help='write a cProfile dump of the run to FILE (view it with pstats or snakeviz)')
+    parser.add_argument('--stats', metavar='FILE',
+        help='write the counters and time spent in each stage to FILE as JSON')
+    parser.add_argument('--diff', metavar='PATH',
+        help='compare with the run whose output directory or manifest is PATH, reusing '
+             'its PIDs and writing only the objects that are new or have changed')
+    parser.add_argument('--ingest', choices=jobOptions['ingest'],
+        help='ingest each object group into fedoraStage (S) or Production (P) as soon '
+             'as it is generated')
+    parser.add_argument('--ingest-url', dest='ingestUrl', metavar='URL',
+        help='ingest into this endpoint instead (e.g. a test server)')
+    parser.add_argument('--ingest-workers', dest='ingestWorkers', type=int, metavar='N',
+        help='number of object groups to ingest at once (default: 4)')
+    parser.add_argument('--sharestream-links', dest='sharestreamLinks', metavar='FILE',
+        help='Sharestream asset export (CSV) whose links fill in SharestreamURLs, '
+             'matching asset titles to FileName')
+    return parser.parse_args()
+
+
+# Reads the answers for a run from a TOML or JSON job file.
+def readJobFile(fileName):
+    if fileName.endswith('.toml'):
+        if tomllib is None:
+            sys.exit('TOML job files require Python 3.11 or later; use JSON instead.')
+        with open(fileName, 'rb') as f:
+            return tomllib.load(f)
+    else:
+        with open(fileName, 'r') as f:
+            return json.load(f)
+
+
+# Checks the answers for a run before any work is done, normalizing choices to 
+# upper case and aborting on unknown settings, bad values (including numbers 
+# given as text) or settings that cannot be used together.
+def checkJob(job):
+    job = dict(job)
+    for key, value in job.items():
+        if key not in jobOptions:
+            sys.exit('Unknown job setting: {0}'.format(key))
+        if key in numberOptions and (not isinstance(value, int) or isinstance(value, bool)
+                                     or value < numberOptions[key]):
+            sys.exit('Bad value for {0}: {1!r} (expected a whole number of at least '
+                     '{2})'.format(key, value, numberOptions[key]))
+        choices = jobOptions[key]
+        if choices is None or (key == 'collection' and isinstance(value, str) and 
+                               ':' in value):
+            continue
+        job[key] = value = str(value).upper()
+        if value not in choices:
+            sys.exit('Bad value for {0}: {1} (expected one of {2})'.format(
+                key, value, ', '.join(choices)))
+    if job.get('diff') and (job.get('ingest') or job.get('ingestUrl')):
+        sys.exit(diffIngestError)
+    return job
+
+
+
+# Collects the answers for a run from the job file, if any, overridden by the 
+# command-line options.
+def loadJob(args):
+    job = {}
+    if args.job:
+        job.update(readJobFile(args.job))
+    for key in jobOptions:
+        value = getattr(args, key)
+        if value is not None:
+            job[key] = value
+    return checkJob(job)
+
+
+# Loads the UMAM and UMDM templates, printing them to screen in verbose mode, and
+# compiles the UMAM template. The UMDM template is compiled by setupBatch once the
+# time units are known.
+def loadTemplates():
+    templates = {}
     
-    # Parse loaded data and request user input to calculate num of PIDS needed
-    pidsNeeded, dataFileArrangement = analyzeDataFile(myData)
+    # Load the UMAM template and print it to screen in verbose mode
+    umamTemplate, templates['umamName'] = loadFile('umam')
+    say("\n UMAM:\n" + umamTemplate, VERBOSE)
+    templates['umam'] = compileTemplate(umamTemplate)
+    say('*' * 30, VERBOSE)
     
-    # Request PIDs from the server OR load PIDs from previously saved file.
-    pidFile = getPids(pidsNeeded)
+    # Load the UMDM template and print it to screen in verbose mode
+    templates['umdmText'], templates['umdmName'] = loadFile('umdm')
+    say("\n UMDM:\n" + templates['umdmText'], VERBOSE)
+    say('*' * 30, VERBOSE)
+    return templates
+
+
+# Collects the batch-related metadata from the job settings or user input, and 
+# attaches the compiled templates. Templates already loaded for an earlier batch
+# may be passed in to avoid loading them again.
+def setupBatch(job, templates=None):
+    batch = {}
     
-    # Parse the XML PID file (either local or from the server) to get list of PIDs
-    pidList = parsePids(pidFile)
+    # Get the mediaType and collection from user input
+    batch['rightsScheme'] = getRightsScheme(job.get('rights'))
+    batch['mediaType'] = getMediaType(job.get('mediaType'))
+    batch['collectionPID'] = getCollection(job.get('collection'))
+    batch['timeUnits'] = timeFormatSelection(job.get('timeFormat'))
     
-    # Check whether the loaded file has enough PIDs, abort if not enough
+    if templates is None:
+        templates = loadTemplates()
+    batch['umam'] = templates['umam']
+    batch['umamName'] = templates['umamName']
+    batch['umdm'] = compileUMDM(templates['umdmText'], batch['timeUnits'])
+    batch['umdmName'] = templates['umdmName']
+    return batch
+
+
+# Checks whether the loaded file has enough PIDs, none of them listed twice,
+# aborting if not
+def checkPids(pidList, pidsNeeded):
     if len(pidList) < pidsNeeded:
         print('Not enough PIDs for your dataset!')
         print('Please reserve additional PIDs from the server and try again.')
         print('Exiting program.')
         quit()
+    duplicates = [pid for pid, n in collections.Counter(pidList[:pidsNeeded]).items() 
+                  if n > 1]
+    if duplicates:
+        print('Error! These PIDs are listed more than once: {0}'.format(', '.join(duplicates)))
+        print('Each object needs a PID of its own; please check the PID file.')
+        print('Exiting program.')
+        quit()
+
+
+# Returns the hits, misses and size of each of the caches of this process, with
+# the proportion of lookups answered from the cache. When rendering in worker
+# processes, the caches used are those of the workers rather than this one.
+def cacheStats():
+    stats = {}
+    for function in (agentFragment, nameFragment, centuryFragment, browseFragment, 
+                     subjectFragment, generateDateTag, normalizeDate, 
+                     technicalMetaTemplate, parseDuration):
+        info = function.cache_info()
+        lookups = info.hits + info.misses
+        stats[function.__name__] = {
+                'hits' :        info.hits, 
+                'misses' :      info.misses, 
+                'size' :        info.currsize,
+                'hitRate' :     round(info.hits / lookups, 3) if lookups else None
+                }
+    return stats
+
+
+# Keeps the counters and stage timers for a run, and prints the progress line
+# with the throughput and estimated time left once generation begins. The total
+# is the number of objects (PIDs) expected, if known. The progress line is redrawn in place on a
+# terminal, and otherwise printed every ten seconds, as when piped through tee.
+class Metrics:
+
+    def __init__(self, total=None):
+        self.counters = collections.Counter()
+        self.stages = collections.defaultdict(float)
+        self.start = time.perf_counter()
+        self.interactive = sys.stdout.isatty()
+        self.progressShown = False
+        self.begin(total)
+
+    # Marks the start of generation, from which the throughput is measured.
+    def begin(self, total=None):
+        self.total = total
+        self.generationStart = self.lastProgress = time.perf_counter()
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    # Adds the time spent in the body of a with statement to the named stage.
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    # Yields the items of an iterable, adding the time spent waiting for each one
+    # to the named stage.
+    def timed(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def progress(self):
+        if common.verbosity != NORMAL:
+            return
+        now = time.perf_counter()
+        if now - self.lastProgress < (0.5 if self.interactive else 10):
+            return
+        self.lastProgress = now
+        done = self.counters['pids']
+        rate = done / (now - self.generationStart)
+        line = '{0} of {1} objects done ({2:.0f} per second'.format(
+            done, self.total or '?', rate)
+        if self.total and rate:
+            line += ', about {0} left'.format(
+                datetime.timedelta(seconds=round((self.total - done) / rate)))
+        line += ')'
+        if self.interactive:
+            print('\r' + line + ' ' * 10, end='', flush=True)
+            self.progressShown = True
+        else:
+            print(line, flush=True)
+
+    def endProgress(self):
+        if self.progressShown:
+            print()
+            self.progressShown = False
+
+    def stats(self):
+        now = time.perf_counter()
+        generation = now - self.generationStart
+        return {
+                'elapsed' :             round(now - self.start, 3),
+                'generation' :          round(generation, 3),
+                'objectsPerSecond' :    round(self.counters['pids'] / generation, 1)
+                                        if generation else None,
+                'counters' :            dict(self.counters),
+                'stages' :              {name: round(seconds, 3) 
+                                         for name, seconds in self.stages.items()},
+                'caches' :              cacheStats()
+                }
+
+    def report(self):
+        stats = self.stats()
+        say('\n{0} groups, {1} parts and {2} PIDs used; {3} bytes written. Generation '
+            'took {4} seconds ({5} objects per second), the whole run {6} seconds.'.format(
+                self.counters['groups'], self.counters['parts'], self.counters['pids'], 
+                self.counters['bytes'], stats['generation'], stats['objectsPerSecond'],
+                stats['elapsed']))
+        say('Time in each stage: ' + ', '.join('{0} {1}s'.format(name, seconds) 
+                                              for name, seconds in stats['stages'].items()))
+        say('Cache hit rates: ' + ', '.join('{0} {1}'.format(name, cache['hitRate']) 
+                                           for name, cache in stats['caches'].items()), VERBOSE)
+
+
+# The number of seconds between flushes of the summary lists and manifest to 
+# disk while a batch is generated
+checkpointInterval = 2.0
+
+
+# Generates the FOXML files and summary lists for a batch, streaming the data 
+# rows through the pipeline into the given output directory or sink. Each group
+# is recorded in the manifest, if given, once its files are handed to the sink, 
+# and the first skip groups (completed by an earlier run) are not generated 
+# again. Given the object digests of a previous run, only the objects that are
+# new or have changed are written, and their PIDs listed in changed.txt (changed
+# holds those already written by an interrupted run being resumed). The summary
+# lists are written into the output directory as each group finishes, and added
+# to the sink at the end if it is an archive; they are flushed to disk together
+# with the manifest every checkpointInterval seconds. The objects written are 
+# also handed to the ingester, if given. Progress is kept in the metrics, if 
+# given. Returns the counts of object groups and files written.
+def runBatch(batch, dataRows, dataFileArrangement, pidList, outputDir='output', workers=1,
+             sink=None, manifest=None, skip=0, metrics=None, previous=None, changed=(),
+             ingester=None):
     
-    # Get the mediaType and collection from user input
-    batch['rightsScheme'] = getRightsScheme()
-    batch['mediaType'] = getMediaType()
-    batch['collectionPID'] = getCollection()
-    batch['nullTimeCounter'], batch['convertTime'], batch['timeUnits'] = timeFormatSelection()
-    convertTime = batch['convertTime']
+    # Write to the output directory unless given another sink. A sink passed in 
+    # is left open for the caller to close.
+    ownSink = sink is None
+    if ownSink:
+        sink = openSink(outputDir)
+    if metrics is None:
+        metrics = Metrics()
     
-    # setup variable to hold sum of constituent UMAM runtimes for UMDM
-    summedRunTime = batch['nullTimeCounter']   
+    objectGroups = 0    # counter for UMDM plus UMAM(s) as a group
+    filesWritten = 0    # counter for file outputs
+    
+    # Open the summary lists of PIDs, UMDM PIDs and links (and of the new or 
+    # changed objects), which are written as each group finishes
+    summary = SummaryWriter(outputDir, listChanged=previous is not None)
+    if previous is not None:
+        summary.addChanged(changed)
     
-    # Load the UMAM template and print it to screen  
-    batch['umam'], batch['umamName'] = loadFile('umam')
-    print("\n UMAM:\n" + batch['umam'])
-    print('*' * 30)
+    # The groups being written, to be recorded in the manifest and ingested in 
+    # order once their files are on disk
+    pending = collections.deque()
+    lastFlush = time.monotonic()
     
-    # Load the UMDM template and print it to screen
-    batch['umdm'], batch['umdmName'] = loadFile('umdm')
-    print("\n UMDM:\n" + batch['umdm'])
-    print('*' * 30)
-
-    # Add omitted data columns
-    print("Adding missing columns...")
-    for row in myData:
-        row.setdefault('AlbumDecade', None)
-        row.setdefault('AlbumBrowse', None)
-
-    # Generate XML for data arranged with multiple lines (UMAM and UMDM) per object
-    if dataFileArrangement == 'M':
+    # Stream the data through the pipeline one object group (a UMDM plus its 
+    # UMAM parts) at a time, so only the groups in progress are held in memory.
+    # PIDs are assigned to each group before it is handed off for rendering.
+    groups = assignPids(groupObjects(dataRows, dataFileArrangement), pidList)
+    for umdm, umams, documents, runTimes, summedRunTime in metrics.timed('render', 
+            renderGroups(groups, batch, workers, skip)):
+        # Begin a new group by incrementing the group counter and printing a notice to screen
+        objectGroups += 1
+        metrics.count('groups')
+        metrics.count('parts', len(umams))
+        metrics.count('pids', len(umams) + 1)
+        say('\nFILE GROUP {0}: '.format(objectGroups), VERBOSE)
         
-        for x in myData:
-            # Attach a PID to the line of data.
-            x['PID'] = pidList[pidCounter]
-            pidCounter += 1
-            
-            # Attach summary info to summary list, depending on XML type
-            if x['XMLType'] == 'UMDM':
-                link = '"{0}","{1}","{2}","http://digital.lib.umd.edu/video?pid={2}"'.format(x['Identifier'],
-                                                                                             x['XMLType'], x['PID'])
-            elif x['XMLType'] == 'UMAM':
-                link = '"{0}","{1}","{2}"'.format(x['Identifier'], x['XMLType'], x['PID'])
-            summaryList.append(link)
-            
-            # Check the XML type for each line, and build the FOXML files accordingly
-            if x['XMLType'] == 'UMDM':
-                print("processing UMDM")
-                # If the mets variable is NOT empty, finish the UMDM for the previous group
-                if mets != "":
-                    myFile = createUMDM(tempData, batch, summedRunTime, mets)
-                    fileStem = tempData['PID'].replace(':', '_').strip()    # convert ':' to '_' in PID for use in filename
-                    writeFile(fileStem, myFile, '.xml')                     # Write the file
-                    
-                    # Print summary info to the screen
-                    print('Creating UMDM for object with {0} parts...'.format(objectParts), end=" ")
-                    print('\nTotal runtime of all parts = {0}.'.format(str(summedRunTime)))
-                    print('UMDM = {0}'.format(fileStem))
-                    
-                    # Append PID to list of all files created and list of UMDM files created
-                    umdmList.append(tempData['PID'])
-                    outputFiles.append(tempData['PID'])
-                    filesWritten += 1
-                    
-                    # Reset counters
-                    objectParts = 0                             # reset parts counter
-                    summedRunTime = batch['nullTimeCounter']    # reset runtime sum counter for masters
-                
-                # Begin a new UMDM group by incrementing the group counter, printing a notice to screen,
-                # storing the line of UMDM data for use after UMAMs are complete, and initiating a new METS
-                objectGroups += 1
-                print('\nFILE GROUP {0}: '.format(objectGroups))
-                tempData = x
-                mets = createMets()
-                
-            # If the line is a UMAM line
-            elif x['XMLType'] == 'UMAM':
-                
-                # Create UMAM, convert PID for use as filename, write the file
-                myFile = createUMAM(x, batch, x['PID'])
-                convertedDerivativeRunTime = convertTime(x['DurationDerivatives'])
-                fileStem = x['PID'].replace(':', '_').strip()
-                writeFile(fileStem, myFile, '.xml')
-                
-                # Increment counters
-                outputFiles.append(x['PID'])
-                summedRunTime += convertedDerivativeRunTime
-                objectParts += 1
-                filesWritten += 1
-                
-                # Print summary info to the screen
-                print('Writing UMAM...', end=' ')
-                print("Converted runtime = {0}".format(convertedDerivativeRunTime))
-                print('Part {0}: UMAM = {1}'.format(objectParts, fileStem))
-                
-                # Update the running METS record for use in finishing the UMDM
-                mets = updateMets(objectParts, mets, x['FileName'], x['PID'])
-                
-        # After iteration complete, finish the last UMDM    
-        myFile = createUMDM(tempData, batch, summedRunTime, mets)
-        fileStem = tempData['PID'].replace(':', '_').strip()    # convert ':' to '_' in PID for use in filename
-        writeFile(fileStem, myFile, '.xml')                     # Write the file
+        # Add the group's objects to the summary lists
+        summary.addGroup(umdm, umams)
         
-        # Print summary info to the screen
-        print('Creating UMDM for object with {0} parts...'.format(objectParts), end=" ")
-        print('\nTotal runtime of all parts = {0}.'.format(str(summedRunTime)))
-        print('UMDM = {0}'.format(fileStem))
-                    
-        # Append PID to list of all files created and list of UMDM files created
-        umdmList.append(tempData['PID'])
-        outputFiles.append(tempData['PID'])
-        filesWritten += 1
+        # Groups completed by an earlier run only need listing in the summaries
+        if documents is None:
+            say('Already completed, skipping.', VERBOSE)
+            metrics.count('skipped')
+            metrics.progress()
+            continue
         
-    # Generate XML for data arranged with single lines (UMAM plus UMDM) per object
-    elif dataFileArrangement == 'S':
+        # Compare each object with the previous run, if any, to find those to write.
+        # The digests are only needed for that and for the manifest.
+        if previous is None and manifest is None:
+            digests = None
+        else:
+            digests = {pid: objectDigest(content) for pid, content in documents}
+        if previous is None:
+            written = None
+        else:
+            written = set(pid for pid in digests if previous.get(pid) != digests[pid])
+            summary.addChanged(pid for pid, content in documents if pid in written)
+            metrics.count('changed', len(written))
+            metrics.count('unchanged', len(documents) - len(written))
+        group = None
+        if manifest is not None or ingester is not None:
+            group = WrittenGroup(objectGroups, documents, digests, written, 
+                                 keepData=ingester is not None)
+            pending.append(group)
         
-        # Assign two PIDs to each line
-        for x in myData:
-            
-            x['umdmPID'] = pidList[pidCounter]
-            pidCounter += 1
-            x['umamPID'] = pidList[pidCounter]
-            pidCounter += 1
-            
-            # Attach summary info to summary list, once for each file
-            link1 = '"{0}","{1}","{2}","http://digital.lib.umd.edu/video?pid={2}"'.format(x['Identifier'],
-                                                                                          'UMDM', x['umdmPID'])
-            link2 = '"{0}","{1}","{2}"'.format(x['Identifier'],
-                                               'UMAM', x['umamPID'])
-            summaryList.append(link1)
-            summaryList.append(link2)
+        for objectParts, ((pid, myFile), convertedDerivativeRunTime) in enumerate(
+                zip(documents, runTimes), 1):
             
-            # Increment the object counter and print feedback to screen
-            objectGroups += 1
-            print('\nFILE GROUP {0}: '.format(objectGroups))
-            
-            # Initiate the METS
-            mets = createMets()
-            
-            # Create UMAM, convert PID for use as filename, write the file
-            myFile = createUMAM(x, batch, x['umamPID'])
-            fileStem = x['umamPID'].replace(':', '_').strip()
-            writeFile(fileStem, myFile, '.xml')
-            
-            # Increment counters
-            summedRunTime += convertedDerivativeRunTime
-            objectParts += 1
+            # Convert PID for use as filename, write the UMAM file
+            fileStem = pid.replace(':', '_').strip()
+            if written is not None and pid not in written:
+                say('Part {0}: UMAM = {1} unchanged'.format(objectParts, fileStem), VERBOSE)
+                continue
+            done = None if group is None else functools.partial(group.fileWritten, pid)
+            with metrics.stage('write'):
+                sink.write(fileStem, myFile, '.xml', done)
             filesWritten += 1
             
-            # Update the running METS record for use in finishing the UMDM
-            mets = updateMets(objectParts, mets, x['File Name'], x['umamPID'])
-            
             # Print summary info to the screen
-            print('Part {0}: UMAM = {1}'.format(objectParts, fileStem))
-            print('Writing UMAM...', end=' ')
-            
-            # Create UMDM
-            createUMDM(x, batch, summedRunTime, mets)
-            
-            # Print summary info to the screen
-            print('Creating UMDM for object with {0} parts...'.format(objectParts), end=" ")
-            print('\nTotal runtime of all parts = {0}.'.format(str(summedRunTime)))
-            print('UMDM = {0}'.format(fileStem))
-            
-            # Append PID to list of all files created and list of UMDM files created
-            umdmList.append(x['umdmPID'])
-            outputFiles.append(x['umdmPID'])
+            say('Writing UMAM... Converted runtime = {0}'.format(
+                convertedDerivativeRunTime), VERBOSE)
+            say('Part {0}: UMAM = {1}'.format(objectParts, fileStem), VERBOSE)
+        
+        # Write the UMDM for the group
+        pid, myFile = documents[-1]
+        fileStem = pid.replace(':', '_').strip()    # convert ':' to '_' in PID for use in filename
+        if written is None or pid in written:
+            done = None if group is None else functools.partial(group.fileWritten, pid)
+            with metrics.stage('write'):
+                sink.write(fileStem, myFile, '.xml', done)     # Write the file
             filesWritten += 1
-          
-            # Reset counters
-            objectParts = 0                     # reset parts counter
-            summedRunTime = nullTimeCounter       # reset runtime sum counter
-            
-    # Abort if the value of dataFileArrangement is something else
-    else:
-        print('Bad dataFileArrangement value!')
-        quit()
         
-    # Generate summary files
-    print('\nWriting pidlist file as pids.txt...')
-    f = '\n'.join(outputFiles)
-    writeFile('pids', f, '.txt')
-    filesWritten += 1
-    
-    print('Writing summary file as links.txt...')
-    l = '\n'.join(summaryList)
-    writeFile('links', l, '.txt')
-    filesWritten += 1
+        # Print summary info to the screen
+        say('Creating UMDM for object with {0} parts... '.format(len(umams)), VERBOSE)
+        say('Total runtime of all parts = {0}.'.format(summedRunTime), VERBOSE)
+        say('UMDM = {0}{1}'.format(fileStem, 
+            '' if written is None or pid in written else ' unchanged'), VERBOSE)
+        
+        # Record in the manifest (and ingest) the groups whose files have been 
+        # written, and every few seconds flush the summary lists and manifest
+        finishGroups(pending, manifest, ingester, metrics)
+        if time.monotonic() - lastFlush >= checkpointInterval:
+            with metrics.stage('write'):
+                summary.flush()
+                if manifest is not None:
+                    manifest.flush()
+            lastFlush = time.monotonic()
+        metrics.progress()
+    metrics.endProgress()
     
-    print('Writing list of UMDM files as UMDMpids.txt...')
-    d = '\n'.join(umdmList)
-    writeFile('UMDMpids', d, '.txt')
-    filesWritten += 1
+    # Wait for the files still being written, and finish the groups left
+    with metrics.stage('write'):
+        sink.flush()
+    finishGroups(pending, manifest, ingester, metrics)
+        
+    # Finish the summary files, adding them to the sink alongside the FOXML
+    with metrics.stage('write'):
+        summaryFiles = summary.close()
+        for summaryPath, fileStem, extension in summaryFiles:
+            say('Wrote {0}'.format(outputPath(fileStem, extension)))
+            sink.addFile(summaryPath, fileStem, extension)
+            filesWritten += 1
+    metrics.count('files', filesWritten)
     
     # Print a divider and summarize output to the screen.
-    print('\n' + ('*' * 30))               
-    print('\n{0} files written: {1} FOXML files in {2}'.format(
-            filesWritten, filesWritten - 3, objectGroups), end=' ')
-    print('groups, plus the summary list of pids, list of UMDM pids, and the links file.')
-    print('Thanks for using the XML generator!\n\n')
+    say('\n' + ('*' * 30))               
+    say('\n{0} files written: {1} FOXML files in {2} groups, plus the summary files '
+        '{3}.'.format(
+            filesWritten, filesWritten - len(summaryFiles), 
+            objectGroups - min(skip, objectGroups),
+            ', '.join(outputPath(fileStem, extension) 
+                      for summaryPath, fileStem, extension in summaryFiles)))
+    if previous is not None:
+        say('{0} of {1} objects are new or have changed since the previous run.'.format(
+            summary.changedObjects, summary.objects))
+    if skip:
+        say('{0} groups were already completed by an earlier run.'.format(
+            min(skip, objectGroups)))
+    if ownSink:
+        with metrics.stage('write'):
+            sink.close()
+        metrics.count('bytes', sink.bytesWritten)
+    return {'groups': objectGroups, 'files': filesWritten}
+
+
+# Runs a batch from start to finish with the given job settings, keeping the 
+# counters and stage timers in the metrics.
+def runJob(job, metrics):
+    
+    # Initiate the program, recording the timestamp and name of user
+    greeting(job.get('name'))
+    
+    # Read the object digests of the previous run to compare against, if any, 
+    # before the output directories are checked
+    previousRun, previous = None, None
+    if job.get('diff') and not job.get('resume'):
+        previousRun, previous = loadDigests(job['diff'])
+    
+    # Check for existence of output directories and create if necessary
+    setup_output_dirs(resume=job.get('resume'))
+    
+    if job.get('resume'):
+        # Pick up an interrupted run from its manifest, with the same data file,
+        # settings and PIDs, skipping the groups already completed
+        if job.get('archive'):
+            sys.exit('Only runs writing to the output directory can be resumed.')
+        run, completed = loadManifest()
+        if run.get('diff') and (job.get('ingest') or job.get('ingestUrl')):
+            sys.exit(diffIngestError)
+        say('\nResuming the run of {0}: {1} object groups already completed.'.format(
+            run['dataFile'], len(completed)))
+        fileName = run['dataFile']
+        dataRows = readData(fileName)
+        if run.get('sharestreamLinks'):
+            job['sharestreamLinks'] = run['sharestreamLinks']
+        dataFileArrangement = run['arrangement']
+        pidList = run['pids']
+        job.update(run['answers'])
+        with metrics.stage('setup'):
+            batch = setupBatch(job)
+        
+        # Compare with the same previous run, if any, as the interrupted run did
+        changed = []
+        if run.get('diff'):
+            previousRun, previous = loadDigests(run['diff'])
+            for record in completed:
+                paths = set(record['files'])
+                changed.extend(pid for pid in record['pids'] if 
+                               outputPath(pid.replace(':', '_').strip(), '.xml') in paths)
+    else:
+        # Load CSV data as a lazy iterator over its rows
+        dataRows, fileName = loadFile('data', job.get('dataFile'))
+        
+        # Check every row of the data before any PIDs are used up, counting the
+        # rows as they are read, and calculate the number of PIDs needed. The 
+        # media type is settled first, as video batches need more columns.
+        dataFileArrangement = getArrangement(job.get('arrangement'))
+        job['mediaType'] = getMediaType(job.get('mediaType'))[0].upper()
+        with metrics.stage('validate'):
+            errors, rowCount = validate.reportErrors(fileName, dataFileArrangement,
+                                                      job['mediaType'])
+        if errors:
+            sys.exit('Please correct the data file and try again. '
+                     'No PIDs have been reserved.')
+        pidsNeeded = analyzeDataFile(rowCount, dataFileArrangement)
+        
+        # Request PIDs from the server OR load PIDs from previously saved file.
+        # When comparing with a previous run, its PIDs are used again in the same
+        # order, so that an unchanged row keeps its object, and only any more
+        # needed for new rows are requested. A PID file is read from the top, so
+        # the PIDs the previous run already used are skipped.
+        with metrics.stage('pids'):
+            if previousRun is None:
+                pidList = getPids(pidsNeeded, job)
+            else:
+                pidList = previousRun['pids'][:pidsNeeded]
+                if len(pidList) < pidsNeeded:
+                    used = set(previousRun['pids'])
+                    pidList += [pid for pid in getPids(pidsNeeded - len(pidList), job)
+                                if pid not in used]
+        checkPids(pidList, pidsNeeded)
         
-main()
+        # Get the batch settings and templates
+        with metrics.stage('setup'):
+            batch = setupBatch(job)
+        
+        # Record the run's settings and PIDs so that it can be resumed
+        run = {'dataFile': fileName, 'arrangement': dataFileArrangement,
+               'answers': batchAnswers(batch), 'pids': pidList[:pidsNeeded]}
+        if previousRun is not None:
+            run['diff'] = os.path.abspath(job['diff'])
+        if job.get('sharestreamLinks'):
+            run['sharestreamLinks'] = os.path.abspath(job['sharestreamLinks'])
+        completed = []
+        changed = []
+    
+    # Fill in the Sharestream links of the parts as the rows are read, if given
+    missingLinks = []
+    if job.get('sharestreamLinks'):
+        with metrics.stage('setup'):
+            dataRows = joinSharestreamLinks(dataRows, job['sharestreamLinks'], missingLinks)
+    
+    # Set up the ingest of each group into Fedora as it is generated, if requested.
+    # With --verify, each document is also checked just before it is posted.
+    ingester = None
+    if job.get('ingest') or job.get('ingestUrl'):
+        url, username, password = ingest.ingestSettings(job)
+        say('\nIngesting each object group into {0} as it is generated...'.format(url))
+        ingester = ingest.Ingester(url, username, password, job.get('ingestWorkers', 4),
+                                   check=job.get('verify'), schemaDir=job.get('schemas'),
+                                   metrics=metrics)
+    
+    # Generate the FOXML and summary files, checkpointing each group in the manifest
+    metrics.begin(len(run['pids']))
+    manifest = startManifest(run, completed)
+    sink = openSink('output', job.get('archive'), job.get('compressionLevel'),
+                    job.get('writerThreads', 1))
+    try:
+        result = runBatch(batch, dataRows, dataFileArrangement, pidList, 
+                          workers=job.get('workers', 1), sink=sink,
+                          manifest=manifest, skip=len(completed), metrics=metrics,
+                          previous=previous, changed=changed, ingester=ingester)
+    finally:
+        with metrics.stage('write'):
+            sink.close()
+        manifest.close()
+        if ingester is not None:
+            with metrics.stage('ingest'):
+                ingested = ingester.close()
+    metrics.count('bytes', sink.bytesWritten)
+    reportJoin('FileNames have no Sharestream link', missingLinks)
+    if ingester is not None and ingested['failed']:
+        print('Some objects were not ingested; see {0}. Run ingest.py on the output '
+              'directory to try them again.'.format(ingester.ledgerPath))
+    if ingester is not None and completed:
+        say('Groups completed before the run was resumed are not ingested here; run '
+            'ingest.py on the output directory to ingest any that were missed.')
+    
+    # Check the FOXML files written before they go anywhere near Fedora, if requested
+    if job.get('verify'):
+        with metrics.stage('verify'):
+            if verify.verifyBatch(job.get('archive') or 'output', job.get('workers'), 
+                                  job.get('schemas')):
+                sys.exit('Some FOXML files failed verification; see the report for details.')
+    
+    # Look up the handles of the UMDM objects and join them to the data, if requested
+    if job.get('handles'):
+        with metrics.stage('handles'):
+            handles.joinHandles(fileName, 
+                                handles.readUMDMLinks(os.path.join('output', 'links.txt')),
+                                os.path.join('output', 'handled.csv'),
+                                job.get('handleWorkers', 8), 
+                                job.get('handleUrl', handles.handleServer),
+                                job.get('handleCache', handles.handleCacheFile))
+    return result
+
+
+def main():
+    # Read the job settings from the command line and job file, if any
+    job = loadJob(parseArgs())
+    if job.get('quiet'):
+        common.verbosity = QUIET
+    elif job.get('verbose'):
+        common.verbosity = VERBOSE
+    
+    # Run the batch, profiling it if requested
+    metrics = Metrics()
+    profiler = None
+    if job.get('profile'):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        runJob(job, metrics)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(job['profile'])
+            say('Profile written to {0}'.format(job['profile']))
+        metrics.endProgress()
+        if job.get('stats'):
+            with open(job['stats'], 'w') as f:
+                json.dump(metrics.stats(), f, indent=2)
+                f.write('\n')
+            say('Statistics written to {0}'.format(job['stats']))
+    metrics.report()
+    say('Thanks for using the XML generator!\n\n')
+
+
+if __name__ == '__main__':
+    main()